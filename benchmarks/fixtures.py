@@ -0,0 +1,167 @@
+"""
+基準測試用的合成資料與本地替身伺服器
+所有資料以固定的亂數種子產生，不需要連上真實的入口網站或攝影機，結果可重現。
+
+- make_portal_html：產生含指定數量 img.cctv-image 的入口網頁，可加入填充內容放大檔案
+- make_links_data / write_links_json：產生指定頁數的 cctv_links.json
+- StandInServer：提供入口網頁、JPEG 快照與 MJPEG 串流，可設定延遲
+"""
+
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+import time
+
+PAGE_SIZE = 9
+
+def make_portal_html(tags, filler_bytes=0, seed=0, camera_base='http://cam.example'):
+    """產生入口網頁：tags 個 CCTV 圖片夾雜一般圖片與文字，總大小約增加 filler_bytes"""
+    rng = random.Random(seed)
+    parts = ["<!DOCTYPE html><html><head><meta charset='utf-8'><title>CCTV</title></head><body>"]
+    filler_per_tag = filler_bytes // max(tags, 1)
+    words = ['道路', '路口', '即時影像', '交通', 'camera', 'traffic', 'north', 'south']
+    for i in range(tags):
+        parts.append(f"<div class='item'><p>{rng.choice(words)} {i}</p>")
+        parts.append(f"<img class='cctv-image' src='{camera_base}/cam/{i}.jpg?r={rng.randrange(10**6)}' alt='{i}'>")
+        if rng.random() < 0.3:
+            parts.append(f"<img class='logo' src='{camera_base}/static/{i}.png'>")
+        if filler_per_tag:
+            text = ' '.join(rng.choice(words) for _ in range(filler_per_tag // 8 + 1))
+            parts.append(f'<p>{text[:filler_per_tag]}</p>')
+        parts.append('</div>')
+    parts.append('</body></html>')
+    return ''.join(parts).encode('utf-8')
+
+def make_links_data(pages, camera_base='http://cam.example', page_size=PAGE_SIZE):
+    """產生 cctv_links.json 的內容（dict）"""
+    links = [f'{camera_base}/cam/{i}.jpg' for i in range(pages * page_size)]
+    return {
+        'timestamp': '20240101_000000',
+        'pages': [links[i:i + page_size] for i in range(0, len(links), page_size)],
+    }
+
+def write_links_json(path, pages, camera_base='http://cam.example'):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(make_links_data(pages, camera_base), f, ensure_ascii=False, indent=2)
+    return path
+
+def make_jpeg(size, seed):
+    """產生指定大小的假 JPEG（只有正確的開頭與結尾標記）"""
+    body = random.Random(seed).randbytes(max(size - 4, 0)).replace(b'\xff', b'\x00')
+    return b'\xff\xd8' + body + b'\xff\xd9'
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        server = self.server
+        server.count(self.path)
+        if server.latency:
+            time.sleep(server.latency)
+        path = self.path.split('?', 1)[0]
+        if path.startswith('/portal/'):
+            return self.send_portal(path[len('/portal/'):])
+        match = re.fullmatch(r'/cam/(\d+)\.(jpg|mjpg)', path)
+        if match and match.group(2) == 'jpg':
+            return self.send_body(server.frame(int(match.group(1))), 'image/jpeg')
+        if match:
+            return self.send_mjpeg(int(match.group(1)))
+        self.send_body(b'not found', 'text/plain', 404)
+    
+    def send_body(self, body, content_type, status=200, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_portal(self, name):
+        body = self.server.pages.get(name)
+        if body is None:
+            return self.send_body(b'not found', 'text/plain', 404)
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_body(body, 'text/html; charset=utf-8', etag=etag)
+    
+    def send_mjpeg(self, cam):
+        server = self.server
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=standin')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while not server.closed:
+                frame = server.frame(cam)
+                self.wfile.write(b'--standin\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(frame))
+                self.wfile.write(frame + b'\r\n')
+                time.sleep(1 / server.fps)
+        except OSError:
+            pass
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    """本地替身伺服器
+    
+    /portal/<名稱>   以 add_page 註冊的入口網頁（支援 ETag/304）
+    /cam/<n>.jpg     JPEG 快照，每 frame_interval 秒換一張
+    /cam/<n>.mjpg    multipart MJPEG 串流，每秒 fps 張
+    所有請求都會先等待 latency 秒。
+    """
+    daemon_threads = True
+    
+    def __init__(self, latency=0.0, frame_bytes=30_000, frame_interval=1.0, fps=10):
+        super().__init__(('127.0.0.1', 0), _StandInHandler)
+        self.latency = latency
+        self.frame_bytes = frame_bytes
+        self.frame_interval = frame_interval
+        self.fps = fps
+        self.pages = {}
+        self.closed = False
+        self.lock = threading.Lock()
+        self.requests = {}  # 路徑（不含查詢字串）-> 請求次數
+        self.frames = {}
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+    
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+    
+    def add_page(self, name, body):
+        self.pages[name] = body
+        return f'{self.base_url}/portal/{name}'
+    
+    def count(self, path):
+        with self.lock:
+            key = path.split('?', 1)[0]
+            self.requests[key] = self.requests.get(key, 0) + 1
+    
+    def frame(self, cam):
+        tick = int(time.monotonic() / self.frame_interval)
+        with self.lock:
+            cached = self.frames.get(cam)
+            if cached is None or cached[0] != tick:
+                cached = self.frames[cam] = (tick, make_jpeg(self.frame_bytes, cam * 1_000_003 + tick))
+            return cached[1]
+    
+    def __enter__(self):
+        self.thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.closed = True
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,173 @@
+"""
+本地伺服器壓力測試
+模擬大量監視畫面同時輪詢 cctv_links.json，並加入幾個傳送緩慢的連線，
+比較原本的單執行緒 TCPServer 與執行緒池伺服器是否會被慢速請求卡住。
+測試期間另外保持多條長時間連線（預設為 /events 推播），確認串流不會佔滿執行緒池。
+
+用法：python benchmarks/load_test.py --pollers 100 --requests 20 --output load.json
+      python benchmarks/load_test.py --workers 4 --streams 16 --skip-baseline
+"""
+
+import argparse
+import functools
+import http.client
+import http.server
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cctv.core  # noqa: E402
+import cctv.store  # noqa: E402
+import cctv.server  # noqa: E402
+from stats import ms, percentile  # noqa: E402
+
+def make_baseline_server():
+    # 原本的作法：單執行緒 TCPServer + HTTP/1.0
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=cctv.core.get_app_dir())
+    return socketserver.TCPServer(('127.0.0.1', 0), handler)
+
+def make_pooled_server(workers):
+    return cctv.server.PooledHTTPServer(('127.0.0.1', 0), cctv.server.CustomHandler, workers)
+
+def slow_client(port, hold, stop):
+    """送出不完整的請求並停留一段時間，模擬慢速連線或長時間串流"""
+    try:
+        with socket.create_connection(('127.0.0.1', port)) as sock:
+            sock.sendall(b'GET /index.html HTTP/1.1\r\nHost: localhost\r\n')
+            stop.wait(hold)
+            sock.sendall(b'Connection: close\r\n\r\n')
+            sock.settimeout(5)
+            while sock.recv(65536):
+                pass
+    except OSError:
+        pass
+
+def stream_client(port, path, stop, opened, lock):
+    """開啟長時間連線（推播或 MJPEG 串流）並持續讀取，直到測試結束"""
+    try:
+        with socket.create_connection(('127.0.0.1', port)) as sock:
+            sock.sendall(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+            sock.settimeout(0.5)
+            status = b''
+            while not stop.is_set():
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    break
+                if not status:
+                    status = chunk.split(b' ', 2)[1]
+                    if status == b'200':
+                        with lock:
+                            opened[0] += 1
+    except OSError:
+        pass
+
+def poller(port, count, path, latencies, errors, lock):
+    """以同一條（可重複使用的）連線連續輪詢"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    local = []
+    failed = 0
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                failed += 1
+            local.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException):
+            failed += 1
+            conn.close()
+    conn.close()
+    with lock:
+        latencies.extend(local)
+        errors[0] += failed
+
+def run_scenario(name, server, pollers, requests_per_poller, slow_clients, hold, path, streams=0,
+                 stream_path='/events'):
+    port = server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    
+    stop = threading.Event()
+    slow_threads = [threading.Thread(target=slow_client, args=(port, hold, stop), daemon=True)
+                    for _ in range(slow_clients)]
+    opened = [0]
+    lock = threading.Lock()
+    stream_threads = [threading.Thread(target=stream_client, args=(port, stream_path, stop, opened, lock),
+                                       daemon=True)
+                      for _ in range(streams)]
+    for t in slow_threads + stream_threads:
+        t.start()
+    time.sleep(0.5 if streams else 0.1)  # 讓慢速連線與長時間連線先佔住伺服器
+    
+    latencies = []
+    errors = [0]
+    workers = [threading.Thread(target=poller, args=(port, requests_per_poller, path, latencies, errors, lock))
+               for _ in range(pollers)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    duration = time.perf_counter() - start
+    
+    stop.set()
+    for t in slow_threads + stream_threads:
+        t.join(timeout=5)
+    server.shutdown()
+    server.server_close()
+    
+    return {
+        'server': name,
+        'pollers': pollers,
+        'streams': streams,
+        'streams_open': opened[0],
+        'requests': len(latencies),
+        'errors': errors[0],
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(latencies) / duration, 1) if duration else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(max(latencies) if latencies else None),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='本地伺服器壓力測試')
+    parser.add_argument('--pollers', type=int, default=100, help='同時輪詢的客戶端數')
+    parser.add_argument('--requests', type=int, default=20, help='每個客戶端的請求數')
+    parser.add_argument('--slow-clients', type=int, default=4, help='慢速連線數')
+    parser.add_argument('--hold', type=float, default=2.0, help='慢速連線停留秒數')
+    parser.add_argument('--streams', type=int, default=8, help='測試期間保持開啟的長時間連線數')
+    parser.add_argument('--stream-path', default='/events', help='長時間連線的路徑')
+    parser.add_argument('--workers', type=int, default=cctv.server.SERVER_WORKERS, help='執行緒池大小')
+    parser.add_argument('--path', default='/' + cctv.store.LINKS_FILE, help='輪詢的路徑')
+    parser.add_argument('--skip-baseline', action='store_true', help='不測試原本的 TCPServer')
+    parser.add_argument('--output', help='將結果寫入 JSON 檔')
+    args = parser.parse_args()
+    
+    results = []
+    if not args.skip_baseline:
+        results.append(run_scenario('TCPServer', make_baseline_server(), args.pollers, args.requests,
+                                    args.slow_clients, args.hold, args.path, args.streams, args.stream_path))
+    results.append(run_scenario('PooledHTTPServer', make_pooled_server(args.workers), args.pollers,
+                                args.requests, args.slow_clients, args.hold, args.path, args.streams,
+                                args.stream_path))
+    
+    output = json.dumps({'load_test': results}, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+啟動時間測試
+比較命令列模式（只匯入子命令需要的 cctv 模組）與一次載入所有模組、tkinter、requests、bs4 的啟動時間。
+每種情境都以新的 Python 行程執行多次，取中位數與最小值。
+
+用法：python benchmarks/startup.py --runs 20 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    # 參考值：只啟動直譯器
+    'python_bare': ['-c', 'pass'],
+    # 命令列模式實際會執行的部分：匯入模組並解析參數
+    'cli_help': [os.path.join(ROOT, 'extract_links.py'), 'extract', '--help'],
+    'import_lazy': ['-c', 'import extract_links, cctv.extract'],
+    # 改版前的行為：匯入時就載入伺服器、圖形介面與網路相關模組
+    'import_eager': ['-c', 'from cctv import gui, server; gui._load_gui_modules(); import bs4, requests.adapters'],
+}
+
+def run_once(args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def measure(args, runs):
+    run_once(args)  # 先執行一次讓檔案進入系統快取
+    samples = [run_once(args) for _ in range(runs)]
+    return {
+        'runs': runs,
+        'median_ms': round(statistics.median(samples) * 1000, 1),
+        'min_ms': round(min(samples) * 1000, 1),
+        'max_ms': round(max(samples) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20, help='每種情境執行次數')
+    parser.add_argument('--output', help='將結果寫入 JSON 檔')
+    args = parser.parse_args()
+    
+    # 沒有圖形環境時 tkinter 仍可匯入，只是不能建立視窗
+    results = {name: measure(scenario, args.runs) for name, scenario in SCENARIOS.items()}
+    baseline = results['import_eager']['median_ms']
+    for name, result in results.items():
+        result['speedup_vs_eager'] = round(baseline / result['median_ms'], 2)
+    
+    text = json.dumps({'python': sys.version.split()[0], 'results': results}, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+if __name__ == '__main__':
+    main()
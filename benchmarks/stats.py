@@ -0,0 +1,15 @@
+"""
+基準測試與壓力測試共用的統計工具
+"""
+
+def ms(value):
+    """秒數換算為毫秒（保留兩位小數）"""
+    return None if value is None else round(value * 1000, 2)
+
+def percentile(values, pct):
+    """計算百分位數（最近排名法）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
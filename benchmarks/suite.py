@@ -0,0 +1,470 @@
+"""
+離線基準測試套件
+以合成資料與本地替身伺服器量測：
+- extract：不同大小的入口網頁（兩種解析方式、1 位元組分段、批次、快取命中），並檢查各方式的連結與 BeautifulSoup 一致
+- save：寫入連結資料庫並匯出 cctv_links.json（即 save_results 的工作）
+- editor：開啟 10～10000 頁的連結資料與 JSON 編輯器模型
+- server：本地伺服器 API、快照代理與 MJPEG 轉送的吞吐量與延遲
+- health：整個主機離線時，攝影機檢查需要幾輪才讓所有頁面進入 skip_pages
+
+結果輸出為 JSON，可用 --compare 與先前的結果比較，找出退步的項目。
+
+用法：
+    python benchmarks/suite.py --quick --output bench.json
+    python benchmarks/suite.py --only extract,server --compare bench.json
+"""
+
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import platform
+import socket
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cctv.core  # noqa: E402
+import cctv.extract  # noqa: E402
+import cctv.store  # noqa: E402
+import cctv.frames  # noqa: E402
+import cctv.prober  # noqa: E402
+import cctv.proxy  # noqa: E402
+import cctv.recorder  # noqa: E402
+import cctv.server  # noqa: E402
+from fixtures import StandInServer, make_portal_html, write_links_json  # noqa: E402
+from stats import ms, percentile  # noqa: E402
+
+SECTIONS = ('extract', 'save', 'editor', 'server', 'health')
+
+# 比較時各指標的方向：越小越好或越大越好
+LOWER_IS_BETTER = ('median_ms', 'p50_ms', 'p95_ms', 'p99_ms')
+HIGHER_IS_BETTER = ('throughput_rps', 'frames_per_client_s')
+
+def timed(fn, repeat):
+    """執行 repeat 次，回傳 (中位數秒數, 最後一次的回傳值)"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+@contextlib.contextmanager
+def unthrottled_upstream():
+    """替身伺服器只有一個主機，量測吞吐量時不套用上游的流量限制（斷路器仍有效）"""
+    saved = cctv.core.upstream
+    cctv.core.upstream = cctv.core.UpstreamClient(rate=None, max_concurrency=None)
+    try:
+        yield
+    finally:
+        cctv.core.upstream.close()
+        cctv.core.upstream = saved
+
+@contextlib.contextmanager
+def scratch_recordings():
+    """錄影檔改寫到暫存目錄，不在實際的 .cctv_cache/recordings 留下檔案"""
+    recorder = cctv.recorder.frame_recorder
+    saved = recorder.directory
+    recorder.directory = tempfile.mkdtemp(prefix='cctv-recordings-')
+    try:
+        yield
+    finally:
+        with recorder.lock:
+            for ring in recorder.rings.values():
+                ring.close()
+            recorder.rings.clear()
+            recorder.last_recorded.clear()
+        shutil.rmtree(recorder.directory, ignore_errors=True)
+        recorder.directory = saved
+
+def check_links(name, expected, actual):
+    """兩種解析方式必須得到相同的連結（順序與網址），不同時停止基準測試"""
+    if actual == expected:
+        return
+    for i, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            raise AssertionError(f'{name}: 第 {i} 個連結不同: {b!r}，BeautifulSoup 為 {a!r}')
+    raise AssertionError(f'{name}: 連結數 {len(actual)}，BeautifulSoup 為 {len(expected)}')
+
+def bench_extract(quick):
+    results = []
+    sizes = [('small', 100, 0), ('medium', 2_000, 2_000_000)]
+    if not quick:
+        sizes.append(('large', 20_000, 20_000_000))
+    with StandInServer() as server:
+        session = cctv.core.create_session()
+        for name, tags, filler in sizes:
+            body = make_portal_html(tags, filler, seed=tags)
+            url = server.add_page(name, body)
+            # 以 BeautifulSoup 的結果為準（只解析一次，不計時）
+            expected = cctv.extract.parse_cctv_links(body.decode('utf-8'))
+            for backend in cctv.extract.EXTRACTOR_BACKENDS:
+                # BeautifulSoup 解析數十 MB 的網頁太慢，大型網頁只測串流解析
+                if backend == 'bs4' and name == 'large':
+                    continue
+                elapsed, result = timed(lambda: cctv.extract.fetch_links(url, session, backend=backend), 3)
+                check_links(f'{name}/{backend}', expected, result.links)
+                results.append({
+                    'name': f'{name}/{backend}',
+                    'bytes': len(body),
+                    'links': len(result.links),
+                    'error': result.error,
+                    'median_ms': ms(elapsed),
+                    'mb_per_s': round(len(body) / elapsed / 1e6, 1) if elapsed else None,
+                })
+            
+            # 每次只給 1 個位元組：標籤、屬性與多位元組字元都會被切開
+            if name != 'large':
+                elapsed, links = timed(lambda: cctv.extract.scan_cctv_links(body[i:i + 1] for i in range(len(body))), 1)
+                check_links(f'{name}/stream-1byte', expected, links)
+                results.append({
+                    'name': f'{name}/stream-1byte',
+                    'bytes': len(body),
+                    'links': len(links),
+                    'median_ms': ms(elapsed),
+                })
+            
+            # 快取命中：第二次起伺服器回 304，不需重新解析
+            with tempfile.TemporaryDirectory() as cache_dir:
+                cache = cctv.extract.SourcePageCache(cache_dir)
+                cctv.extract.fetch_links(url, session, cache=cache)
+                elapsed, result = timed(lambda: cctv.extract.fetch_links(url, session, cache=cache), 5)
+                check_links(f'{name}/cached', expected, result.links)
+                results.append({
+                    'name': f'{name}/cached',
+                    'bytes': len(body),
+                    'links': len(result.links),
+                    'cache_status': result.cache_status,
+                    'median_ms': ms(elapsed),
+                })
+        session.close()
+    
+    # 批次：多個有延遲的來源網址同時提取
+    with StandInServer(latency=0.05) as server, unthrottled_upstream():
+        urls = [server.add_page(f'batch{i}', make_portal_html(50, 20_000, seed=i)) for i in range(32)]
+        elapsed, batch = timed(lambda: cctv.extract.extract_links_batch(urls), 3)
+        results.append({
+            'name': 'batch/32x50ms',
+            'urls': len(urls),
+            'links': len(cctv.extract.merge_links(batch)),
+            'errors': sum(not r.ok for r in batch),
+            'median_ms': ms(elapsed),
+        })
+    return results
+
+def bench_save(quick):
+    results = []
+    counts = [1_000, 10_000] if quick else [1_000, 10_000, 100_000]
+    for count in counts:
+        links = [f'http://cam.example/cam/{i}.jpg' for i in range(count)]
+        with tempfile.TemporaryDirectory() as directory:
+            store = cctv.store.LinkStore(os.path.join(directory, 'links.db'),
+                                            os.path.join(directory, 'links.json'))
+            # 與 save_results 相同：寫入資料庫、匯出 JSON、取得統計
+            elapsed, _ = timed(lambda: (store.add_links(links), store.stats()), 1)
+            results.append({'name': f'new/{count}', 'links': count, 'median_ms': ms(elapsed)})
+            
+            # 已有大量連結時再加入一小批新連結（含重複），每次都是新的網址
+            batches = iter(range(3))
+            
+            def append():
+                batch = next(batches)
+                more = links[-50:] + [f'http://cam.example/new/{batch}/{i}.jpg' for i in range(100)]
+                return store.add_links(more), store.stats()
+            elapsed, _ = timed(append, 3)
+            results.append({'name': f'append/{count}+100', 'links': count, 'median_ms': ms(elapsed)})
+            store.conn.close()
+    return results
+
+def bench_editor(quick):
+    results = []
+    page_counts = [10, 100, 1_000] if quick else [10, 100, 1_000, 10_000]
+    for pages in page_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = write_links_json(os.path.join(directory, 'links.json'), pages)
+            db_path = os.path.join(directory, 'links.db')
+            
+            # 第一次開啟：由 cctv_links.json 匯入資料庫
+            start = time.perf_counter()
+            store = cctv.store.LinkStore(db_path, json_path)
+            import_s = time.perf_counter() - start
+            
+            # 開啟編輯器：建立模型並載入第一頁
+            def open_editor():
+                model = cctv.store.LinkEditorModel(store)
+                model.get(0)
+                return model
+            elapsed, model = timed(open_editor, 5)
+            
+            # 搜尋最後一頁的連結
+            needle = model.store.page_links(model.page_keys[-1])[0]
+            search_s, _ = timed(lambda: model.search(needle), 5)
+            results.append({
+                'name': f'pages/{pages}',
+                'pages': len(model),
+                'import_ms': ms(import_s),
+                'median_ms': ms(elapsed),
+                'search_ms': ms(search_s),
+            })
+            store.conn.close()
+    return results
+
+def run_clients(port, paths, clients, duration, headers=None):
+    """以 clients 條 keep-alive 連線在 duration 秒內輪流請求 paths"""
+    latencies = []
+    errors = [0]
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        local_status = {}
+        failed = 0
+        i = offset
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=headers or {})
+                response = conn.getresponse()
+                response.read()
+                local.append(time.perf_counter() - start)
+                local_status[response.status] = local_status.get(response.status, 0) + 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+            for status, count in local_status.items():
+                statuses[status] = statuses.get(status, 0) + count
+    
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+    }
+
+def read_stream(port, path, duration, counts, index):
+    """讀取 MJPEG 串流 duration 秒，記錄收到的畫面數"""
+    deadline = time.perf_counter() + duration
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        conn.request('GET', path)
+        response = conn.getresponse()
+        while time.perf_counter() < deadline:
+            line = response.fp.readline()
+            if not line:
+                break
+            if line.lower().startswith(b'content-length:'):
+                response.fp.readline()  # 空行
+                response.fp.read(int(line.split(b':')[1]))
+                counts[index] += 1
+        conn.close()
+    except (OSError, http.client.HTTPException):
+        pass
+
+def bench_server(quick):
+    results = []
+    duration = 2.0 if quick else 5.0
+    clients = 16 if quick else 64
+    saved_index = cctv.proxy.link_index
+    with contextlib.ExitStack() as stack:
+        directory = stack.enter_context(tempfile.TemporaryDirectory())
+        cameras = stack.enter_context(StandInServer(latency=0.02))
+        stack.enter_context(unthrottled_upstream())
+        stack.enter_context(scratch_recordings())
+        json_path = write_links_json(os.path.join(directory, 'links.json'), 100, cameras.base_url)
+        cctv.proxy.link_index = cctv.proxy.LinkIndex(json_path)
+        server = cctv.server.PooledHTTPServer(('127.0.0.1', 0), cctv.server.CustomHandler)
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            etag, _ = cctv.proxy.link_index.manifest()
+            page_paths = [f'/api/pages/{i}' for i in range(100)]
+            cam_ids = [cctv.frames.camera_id(f'{cameras.base_url}/cam/{i}.jpg') for i in range(9)]
+            scenarios = [
+                ('manifest', ['/api/manifest'], None),
+                ('manifest/304', ['/api/manifest'], {'If-None-Match': etag}),
+                ('pages', page_paths, None),
+                ('snapshot/9cams', [f'/snapshot/{cam_id}' for cam_id in cam_ids], None),
+            ]
+            for name, paths, headers in scenarios:
+                before = sum(cameras.requests.values())
+                result = run_clients(port, paths, clients, duration, headers)
+                result['name'] = name
+                result['upstream_requests'] = sum(cameras.requests.values()) - before
+                results.append(result)
+            
+            # MJPEG 轉送：多個觀看者共用一條上游連線
+            mjpeg_url = f'{cameras.base_url}/cam/0.mjpg'
+            cctv.proxy.link_index.by_id[cctv.frames.camera_id(mjpeg_url)] = mjpeg_url
+            viewers = 8 if quick else 32
+            counts = [0] * viewers
+            path = f'/stream/{cctv.frames.camera_id(mjpeg_url)}'
+            threads = [threading.Thread(target=read_stream, args=(port, path, duration, counts, i))
+                       for i in range(viewers)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            results.append({
+                'name': f'stream/{viewers}viewers',
+                'clients': viewers,
+                'upstream_fps': cameras.fps,
+                'frames_per_client_s': round(statistics.mean(counts) / duration, 2),
+                'upstream_connections': cameras.requests.get('/cam/0.mjpg', 0),
+            })
+        finally:
+            server.shutdown()
+            server.server_close()
+            cctv.proxy.link_index = saved_index
+    return results
+
+def bench_health(quick):
+    """所有攝影機所在的主機拒絕連線：斷路後被拒絕的檢查也要算失敗，否則其餘攝影機永遠不會離線"""
+    pages = 3
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    base_url = f'http://127.0.0.1:{sock.getsockname()[1]}'
+    sock.close()
+    saved_index, saved_prober, saved_upstream = (cctv.proxy.link_index, cctv.proxy.health_prober,
+                                                 cctv.core.upstream)
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = write_links_json(os.path.join(directory, 'links.json'), pages, base_url)
+        cctv.proxy.link_index = cctv.proxy.LinkIndex(json_path)
+        cctv.proxy.health_prober = cctv.prober.HealthProber(cctv.proxy.link_index)
+        cctv.core.upstream = cctv.core.UpstreamClient(rate=None, max_concurrency=None, open_seconds=1)
+        try:
+            rounds = 0
+            samples = []
+            skip_pages = []
+            while rounds < cctv.prober.PROBE_DEAD_AFTER:
+                start = time.perf_counter()
+                cctv.proxy.health_prober.run_once()
+                samples.append(time.perf_counter() - start)
+                rounds += 1
+                skip_pages = json.loads(cctv.proxy.link_index.manifest()[1])['skip_pages']
+            if skip_pages != list(range(pages)):
+                raise AssertionError(f'dead_host: {rounds} 輪檢查後 skip_pages 為 {skip_pages}，應為所有頁面')
+            report = cctv.proxy.health_prober.report()
+        finally:
+            cctv.core.upstream.close()
+            cctv.proxy.link_index, cctv.proxy.health_prober, cctv.core.upstream = (
+                saved_index, saved_prober, saved_upstream)
+    return [{
+        'name': 'dead_host',
+        'cameras': pages * cctv.store.PAGE_SIZE,
+        'rounds': rounds,
+        'skip_pages': len(skip_pages),
+        'recorded': len(report),
+        'dead': sum(not health['alive'] for health in report.values()),
+        'median_ms': ms(statistics.median(samples)),
+    }]
+
+BENCHMARKS = {
+    'extract': bench_extract,
+    'save': bench_save,
+    'editor': bench_editor,
+    'server': bench_server,
+    'health': bench_health,
+}
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(previous, current, threshold):
+    """列出比先前結果差超過 threshold（比例）的指標"""
+    regressions = []
+    for section, entries in current['results'].items():
+        old_entries = {entry['name']: entry for entry in previous.get('results', {}).get(section, [])}
+        for entry in entries:
+            old = old_entries.get(entry['name'])
+            if old is None:
+                continue
+            for key in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+                new_value, old_value = entry.get(key), old.get(key)
+                if not new_value or not old_value:
+                    continue
+                change = new_value / old_value - 1
+                worse = change > threshold if key in LOWER_IS_BETTER else change < -threshold
+                if worse:
+                    regressions.append({
+                        'section': section, 'name': entry['name'], 'metric': key,
+                        'previous': old_value, 'current': new_value, 'change': round(change, 3),
+                    })
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='縮小資料量與測試時間')
+    parser.add_argument('--only', help='只執行指定項目（逗號分隔）：' + ','.join(SECTIONS))
+    parser.add_argument('--output', help='將結果寫入 JSON 檔')
+    parser.add_argument('--compare', help='與先前輸出的 JSON 比較')
+    parser.add_argument('--threshold', type=float, default=0.2, help='視為退步的變化比例')
+    args = parser.parse_args()
+    
+    sections = args.only.split(',') if args.only else list(SECTIONS)
+    for section in sections:
+        if section not in BENCHMARKS:
+            parser.error(f'未知的項目: {section}')
+    
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'quick': args.quick,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {},
+    }
+    for section in sections:
+        print(f'執行 {section}...', file=sys.stderr)
+        # 受測程式的訊息改到 stderr，stdout 只輸出結果 JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            report['results'][section] = BENCHMARKS[section](args.quick)
+    
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['regressions'] = compare(json.load(f), report, args.threshold)
+        exit_code = 1 if report['regressions'] else 0
+    
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    return exit_code
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+"""
+CCTV 連結提取工具的程式套件
+
+core 為共用基礎設施；extract、crawler 與 store 負責提取、爬取與儲存連結；
+frames、prober、proxy、recorder、events、warmup 與 mosaic 是本地伺服器的各項功能，
+由 server 組合成 HTTP 伺服器；gui 為圖形介面。命令列入口為 extract_links.py。
+"""
@@ -0,0 +1,437 @@
+"""
+共用的基礎設施：程式目錄、原子寫入、監控指標與上游連線層
+"""
+
+from dataclasses import dataclass, field
+from contextlib import contextmanager
+import tempfile
+from urllib.parse import urlsplit
+import os
+import threading
+import time
+import sys
+
+# 連線設定
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+DEFAULT_TIMEOUT = 15  # 每個網址的逾時秒數
+DEFAULT_WORKERS = 8  # 批次提取的同時連線數
+CHUNK_SIZE = 64 * 1024  # 串流讀取的區塊大小
+CACHE_DIR_NAME = '.cctv_cache'  # 來源頁面快取目錄
+
+def get_app_dir():
+    """取得執行檔或腳本所在的目錄"""
+    if getattr(sys, 'frozen', False):
+        # 如果是執行檔
+        return os.path.dirname(sys.executable)
+    # 如果是腳本：cctv 套件的上一層，也就是 extract_links.py 所在的目錄
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@contextmanager
+def atomic_write(path, mode='w', encoding=None):
+    """先寫入同目錄的暫存檔，成功後再以 os.replace 取代 path
+    
+    讀取端不會看到寫到一半的檔案，中途失敗時目標檔案維持原樣；暫存檔名不固定，多個執行緒或行程同時寫入也不會互相覆寫。
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# 監控指標設定
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # 延遲直方圖的區間（秒）
+
+class Metrics:
+    """執行緒安全的計數器、直方圖與即時數值，以 Prometheus 文字格式輸出"""
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.meta = {}  # 指標名稱 -> (類型, 說明)
+        self.counters = {}  # (名稱, 標籤) -> 數值
+        self.histograms = {}  # (名稱, 標籤) -> [各區間次數..., 總和, 次數]
+        self.gauges = {}  # 名稱 -> 回傳 {標籤: 數值} 的函式
+    
+    def describe(self, name, kind, help_text):
+        self.meta[name] = (kind, help_text)
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+    
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+    
+    def gauge(self, name, help_text, fn):
+        """登錄即時數值，輸出時才呼叫 fn()；fn 回傳數值或 {標籤 tuple: 數值}"""
+        self.describe(name, 'gauge', help_text)
+        self.gauges[name] = fn
+    
+    def counter_total(self, name, where=None):
+        """加總計數器；where 為篩選標籤 dict 的函式"""
+        with self.lock:
+            return sum(value for (key, labels), value in self.counters.items()
+                       if key == name and (where is None or where(dict(labels))))
+    
+    def quantile(self, name, q):
+        """由直方圖估計分位數（取所在區間的上限，單位秒），沒有資料時回傳 None"""
+        with self.lock:
+            merged = [0] * len(self.buckets)
+            count = 0
+            for (key, _), values in self.histograms.items():
+                if key == name:
+                    merged = [a + b for a, b in zip(merged, values)]
+                    count += values[-1]
+        if not count:
+            return None
+        for bound, cumulative in zip(self.buckets, merged):
+            if cumulative >= q * count:
+                return bound
+        return float('inf')
+    
+    def render(self):
+        """輸出 Prometheus 文字格式"""
+        def fmt_labels(labels):
+            if not labels:
+                return ''
+            escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+            return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+        
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        lines = []
+        described = set()
+        
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                help_text = self.meta.get(name, (kind, ''))[1]
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+        
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{fmt_labels(labels)} {value}')
+        for (name, labels), values in histograms:
+            header(name, 'histogram')
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{name}_bucket{fmt_labels(labels + (("le", bound),))} {count}')
+            lines.append(f'{name}_bucket{fmt_labels(labels + (("le", "+Inf"),))} {values[-1]}')
+            lines.append(f'{name}_sum{fmt_labels(labels)} {values[-2]}')
+            lines.append(f'{name}_count{fmt_labels(labels)} {values[-1]}')
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            header(name, 'gauge')
+            if isinstance(value, dict):
+                for labels, item in sorted(value.items()):
+                    lines.append(f'{name}{fmt_labels(labels)} {item}')
+            else:
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()  # 共用的監控指標
+
+def create_session(pool_size=DEFAULT_WORKERS):
+    """建立可重複使用連線的 Session"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
+# 上游連線設定（每個主機分別計算）
+UPSTREAM_RATE = 10.0  # 每秒可發出的請求數（權杖桶的補充速率）
+UPSTREAM_BURST = 20  # 權杖桶容量，即閒置後可連續發出的請求數
+UPSTREAM_MAX_CONCURRENCY = 8  # 同時進行的請求數上限（長時間的串流只在建立連線時佔用名額）
+UPSTREAM_POOL_SIZE = 16  # 每個主機保留的 keep-alive 連線數
+UPSTREAM_ACQUIRE_TIMEOUT = 10  # 等待權杖或名額的最長秒數，逾時視為主機忙碌而放棄
+UPSTREAM_FAILURE_THRESHOLD = 5  # 連續失敗幾次後斷路
+UPSTREAM_OPEN_SECONDS = 30  # 斷路多久後放行試探請求（秒）
+UPSTREAM_HALF_OPEN_PROBES = 1  # 試探期間同時放行的請求數
+UPSTREAM_BACKGROUND_CONCURRENCY = 2  # 背景請求（攝影機檢查）同時進行的數量上限
+UPSTREAM_BACKGROUND_RESERVE = 0.5  # 權杖桶中保留給觀看請求的比例，背景請求只能使用超過這個比例的權杖
+
+metrics.describe('cctv_upstream_host_requests_total', 'counter', '經由上游連線層發出的請求數（依主機與結果）')
+metrics.describe('cctv_upstream_rejected_total', 'counter', '斷路中或等待逾時而沒有發出的請求數（依主機與原因）')
+metrics.describe('cctv_upstream_throttle_seconds', 'histogram', '等待權杖或同時請求名額的時間')
+metrics.describe('cctv_upstream_circuit_opens_total', 'counter', '斷路次數（依主機）')
+
+class UpstreamUnavailable(Exception):
+    """主機斷路中或等待名額逾時，請求沒有發出；reason 為 'open'、'half_open' 或 'timeout'"""
+    def __init__(self, message, reason=None):
+        super().__init__(message)
+        self.reason = reason
+
+@dataclass
+class UpstreamHost:
+    """單一上游主機的連線池、流量限制與斷路器狀態"""
+    session: object
+    tokens: float
+    updated: float  # 上次補充權杖的時間
+    cond: threading.Condition = field(default_factory=threading.Condition)
+    active: int = 0  # 進行中的請求數
+    background: int = 0  # 進行中的背景請求數
+    state: str = 'closed'  # closed（正常）、open（斷路）或 half_open（試探中）
+    failures: int = 0  # 連續失敗次數
+    opened_at: float = 0.0
+    probes: int = 0  # 進行中的試探請求數
+    requests: int = 0
+    errors: int = 0
+    rejected: int = 0
+    throttled: int = 0  # 需要等待權杖或名額的請求數
+    opens: int = 0
+    last_error: str = None
+
+def _is_host_failure(error):
+    # 連線錯誤與逾時表示主機有問題；404 之類的錯誤只和個別網址有關
+    import requests
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+class UpstreamClient:
+    """所有向外部主機發出的請求共用的連線層
+    
+    每個主機各有一個保持連線的 Session、權杖桶流量限制與同時請求數上限。
+    連續失敗時斷路並直接拒絕請求，經過 open_seconds 後放行少量試探請求，成功才恢復正常。
+    rate 或 max_concurrency 為 None 時不限制。
+    """
+    def __init__(self, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, max_concurrency=UPSTREAM_MAX_CONCURRENCY,
+                 pool_size=UPSTREAM_POOL_SIZE, acquire_timeout=UPSTREAM_ACQUIRE_TIMEOUT,
+                 failure_threshold=UPSTREAM_FAILURE_THRESHOLD, open_seconds=UPSTREAM_OPEN_SECONDS):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.acquire_timeout = acquire_timeout
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.lock = threading.Lock()
+        self.hosts = {}  # 主機（含埠號）-> UpstreamHost
+    
+    def _host(self, name):
+        with self.lock:
+            host = self.hosts.get(name)
+            if host is None:
+                host = self.hosts[name] = UpstreamHost(create_session(self.pool_size), self.burst, time.monotonic())
+            return host
+    
+    def _reject(self, name, host, reason, message):
+        host.rejected += 1
+        metrics.inc('cctv_upstream_rejected_total', host=name, reason=reason)
+        return UpstreamUnavailable(f"{message}: {name}", reason)
+    
+    def _acquire(self, name, host, background=False):
+        """等待權杖與名額，回傳是否為試探請求
+        
+        試探請求的名額在等待權杖之前就先佔住，同一時間只會有一個請求成為試探請求。
+        背景請求只能使用保留量以外的權杖，同時進行的數量也另有上限，不會排擠觀看中的請求。
+        """
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        waited = False
+        probe = False
+        reserve = self.burst * UPSTREAM_BACKGROUND_RESERVE if background else 0
+        with host.cond:
+            try:
+                while True:
+                    now = time.monotonic()
+                    if not probe:
+                        if host.state == 'open':
+                            if now - host.opened_at < self.open_seconds:
+                                raise self._reject(name, host, 'open', "上游主機斷路中")
+                            host.state = 'half_open'
+                        if host.state == 'half_open':
+                            if host.probes >= UPSTREAM_HALF_OPEN_PROBES:
+                                # 試探結果出來前其他請求一律拒絕
+                                raise self._reject(name, host, 'half_open', "上游主機試探中")
+                            host.probes += 1
+                            probe = True
+                    if self.rate:
+                        host.tokens = min(self.burst, host.tokens + (now - host.updated) * self.rate)
+                        host.updated = now
+                    has_token = not self.rate or host.tokens >= 1 + reserve
+                    has_slot = ((not self.max_concurrency or host.active < self.max_concurrency)
+                                and (not background or host.background < UPSTREAM_BACKGROUND_CONCURRENCY))
+                    if has_token and has_slot:
+                        break
+                    if now >= deadline:
+                        raise self._reject(name, host, 'timeout', "等待上游主機逾時")
+                    waited = True
+                    # 缺權杖時等到補充足夠的權杖；缺名額時等其他請求結束的通知
+                    timeout = deadline - now
+                    if not has_token:
+                        timeout = min(timeout, (1 + reserve - host.tokens) / self.rate)
+                    host.cond.wait(timeout)
+            except UpstreamUnavailable:
+                if probe:
+                    # 沒有發出試探請求，讓下一個請求試探
+                    host.probes -= 1
+                raise
+            if self.rate:
+                host.tokens -= 1
+            host.active += 1
+            if background:
+                host.background += 1
+            host.requests += 1
+            if waited:
+                host.throttled += 1
+        if waited:
+            metrics.observe('cctv_upstream_throttle_seconds', time.monotonic() - start, host=name,
+                            priority='background' if background else 'interactive')
+        return probe
+    
+    def _release(self, name, host, probe, error, responded, background=False):
+        # error 為主機失敗的原因；沒有失敗也沒有收到回應（例如網址格式錯誤）時不影響斷路器
+        opened = False
+        with host.cond:
+            host.active -= 1
+            if background:
+                host.background -= 1
+            if probe:
+                host.probes -= 1
+            if error is not None:
+                host.errors += 1
+                host.failures += 1
+                host.last_error = error
+                if probe or (host.state == 'closed' and host.failures >= self.failure_threshold):
+                    host.state = 'open'
+                    host.opened_at = time.monotonic()
+                    host.opens += 1
+                    opened = True
+            elif responded:
+                # 只有主機確實回應才算成功
+                host.failures = 0
+                if probe:
+                    host.state = 'closed'
+            host.cond.notify_all()
+        outcome = 'error' if error is not None else 'ok' if responded else 'no_response'
+        metrics.inc('cctv_upstream_host_requests_total', host=name, outcome=outcome)
+        if opened:
+            metrics.inc('cctv_upstream_circuit_opens_total', host=name)
+            print(f"上游主機 {name} 連續失敗，暫停請求 {self.open_seconds} 秒: {error}")
+    
+    @contextmanager
+    def get(self, url, headers=None, timeout=DEFAULT_TIMEOUT, long_lived=False, background=False):
+        """發出串流 GET 請求，在 with 區塊中讀取回應；斷路中或等待逾時時拋出 UpstreamUnavailable
+        
+        連線錯誤、逾時、5xx 與 429 計為主機失敗，收到其他回應才算成功。long_lived 的串流收到回應標頭後
+        就釋放名額並記錄結果，之後讀取時的錯誤不計入斷路器。background 的請求優先順序較低（見 _acquire）。
+        """
+        name = urlsplit(url).netloc.lower()
+        host = self._host(name)
+        probe = self._acquire(name, host, background)
+        error = None
+        responded = False
+        released = False
+        try:
+            response = host.session.get(url, headers=headers, timeout=timeout, stream=True)
+            if response.status_code >= 500 or response.status_code == 429:
+                error = f"HTTP {response.status_code}"
+            else:
+                responded = True
+            if long_lived:
+                released = True
+                self._release(name, host, probe, error, responded, background)
+            with response:
+                yield response
+        except Exception as e:
+            if _is_host_failure(e):
+                # 讀取內容時連線中斷或逾時，即使已收到標頭也算失敗
+                error = error or str(e) or type(e).__name__
+                responded = False
+            raise
+        finally:
+            if not released:
+                self._release(name, host, probe, error, responded, background)
+    
+    def report(self):
+        """回傳限制設定與各主機的狀態（dict）"""
+        now = time.monotonic()
+        with self.lock:
+            hosts = sorted(self.hosts.items())
+        result = {}
+        for name, host in hosts:
+            with host.cond:
+                tokens = host.tokens
+                if self.rate:
+                    tokens = min(self.burst, tokens + (now - host.updated) * self.rate)
+                retry_in = None
+                if host.state == 'open':
+                    retry_in = round(max(self.open_seconds - (now - host.opened_at), 0.0), 1)
+                result[name] = {
+                    "state": host.state,
+                    "active": host.active,
+                    "background": host.background,
+                    "tokens": round(tokens, 1),
+                    "consecutive_failures": host.failures,
+                    "retry_in": retry_in,
+                    "requests": host.requests,
+                    "errors": host.errors,
+                    "rejected": host.rejected,
+                    "throttled": host.throttled,
+                    "opens": host.opens,
+                    "last_error": host.last_error,
+                }
+        return {
+            "limits": {
+                "rate": self.rate,
+                "burst": self.burst,
+                "max_concurrency": self.max_concurrency,
+                "background_concurrency": UPSTREAM_BACKGROUND_CONCURRENCY,
+                "background_reserve": UPSTREAM_BACKGROUND_RESERVE,
+                "failure_threshold": self.failure_threshold,
+                "open_seconds": self.open_seconds,
+            },
+            "hosts": result,
+        }
+    
+    def close(self):
+        """關閉所有主機的連線"""
+        with self.lock:
+            hosts = list(self.hosts.values())
+            self.hosts.clear()
+        for host in hosts:
+            host.session.close()
+
+upstream = UpstreamClient()  # 共用的上游連線層
+
+def _upstream_gauge(fn):
+    return lambda: {(('host', name),): fn(host) for name, host in list(upstream.hosts.items())}
+
+metrics.gauge('cctv_upstream_active', '各主機進行中的請求數', _upstream_gauge(lambda host: host.active))
+metrics.gauge('cctv_upstream_circuit_open', '各主機是否斷路中（含試探中）', _upstream_gauge(lambda host: int(host.state != 'closed')))
+
+def open_url(url, session=None, headers=None, timeout=DEFAULT_TIMEOUT):
+    """發出串流 GET 請求（回傳可用於 with 的回應）；沒有指定 session 時經由共用的上游連線層"""
+    if session is None:
+        return upstream.get(url, headers=headers, timeout=timeout)
+    return session.get(url, headers=headers, timeout=timeout, stream=True)
@@ -0,0 +1,272 @@
+"""
+從起始網址爬取同網站的頁面並收集 CCTV 連結（可從檢查點繼續）
+"""
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+import json
+import hashlib
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit, urlunsplit, urljoin
+from datetime import datetime
+import os
+import time
+from cctv.core import (CACHE_DIR_NAME, CHUNK_SIZE, DEFAULT_TIMEOUT, atomic_write, get_app_dir, metrics,
+                       open_url)
+from cctv.extract import ExtractionCancelled, ExtractionResult, scan_cctv_links, _cancellable
+
+# 爬取設定
+CRAWL_MAX_DEPTH = 2  # 從起始網址最多跟隨幾層連結
+CRAWL_MAX_PAGES = 500  # 最多抓取的頁面數（從檢查點繼續時包含先前已抓取的頁面）
+CRAWL_WORKERS = 8  # 同時抓取的頁面數
+CRAWL_PER_HOST = 2  # 同一主機同時抓取的頁面數上限
+CRAWL_HOST_DELAY = 0.5  # 同一主機兩次請求之間的最短間隔（秒）
+CRAWL_CHECKPOINT_EVERY = 20  # 每抓取幾個頁面寫入一次檢查點
+CRAWL_DIR_NAME = 'crawl'  # 檢查點目錄（位於來源頁面快取目錄下）
+# 明顯不是網頁的副檔名，不必下載
+CRAWL_SKIP_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg', '.ico', '.css', '.js',
+                         '.pdf', '.zip', '.rar', '.mp4', '.avi', '.m3u8', '.mjpg', '.mjpeg')
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+metrics.describe('cctv_crawl_pages_total', 'counter', '爬取的頁面數')
+
+def normalize_url(url, base=None):
+    """正規化網址以便去重：轉為絕對網址、主機轉小寫、移除片段與預設埠號；不是 http(s) 網址時回傳 None"""
+    try:
+        parts = urlsplit(urljoin(base, url.strip()) if base else url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+    host = parts.hostname
+    if ':' in host:
+        host = f'[{host}]'  # IPv6 位址
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        host = f'{host}:{port}'
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+def site_of(url):
+    """網站識別：主機名稱（忽略開頭的 www.）"""
+    host = urlsplit(url).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+def crawl_checkpoint_path(seeds):
+    """依起始網址決定預設的檢查點檔案"""
+    seeds = [normalize_url(seed) or seed for seed in seeds]
+    key = hashlib.sha1('\n'.join(seeds).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(get_app_dir(), CACHE_DIR_NAME, CRAWL_DIR_NAME, f'{key}.json')
+
+class SiteCrawler:
+    """從起始網址爬取同網站的頁面，收集所有 img.cctv-image 連結
+    
+    依深度順序抓取，限制跟隨深度與頁面總數，同一主機的同時抓取數與請求間隔也有上限。
+    圖片連結會依所在頁面轉為絕對網址。提供 checkpoint 時定期寫入進度，中斷後可從該處繼續。
+    """
+    def __init__(self, seeds, max_depth=CRAWL_MAX_DEPTH, max_pages=CRAWL_MAX_PAGES, workers=CRAWL_WORKERS,
+                 per_host=CRAWL_PER_HOST, delay=CRAWL_HOST_DELAY, timeout=DEFAULT_TIMEOUT, checkpoint=None):
+        self.seeds = list(dict.fromkeys(url for url in map(normalize_url, seeds) if url))
+        self.sites = {site_of(url) for url in self.seeds}
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.delay = delay
+        self.timeout = timeout
+        self.checkpoint = checkpoint
+        self.queues = OrderedDict()  # 主機 -> 待抓取的 (網址, 深度)，各主機輪流取出
+        self.seen = set()  # 曾經加入待抓取佇列的網址
+        self.links = []  # 找到的圖片連結（不重複，依發現順序）
+        self.link_set = set()
+        self.pages_done = 0
+        self.errors = 0
+        for url in self.seeds:
+            self._enqueue(url, 0)
+    
+    @property
+    def pending(self):
+        """尚未抓取的網址數"""
+        return sum(len(q) for q in self.queues.values())
+    
+    def _enqueue(self, url, depth, front=False):
+        queue_ = self.queues.setdefault(urlsplit(url).netloc, deque())
+        if front:
+            queue_.appendleft((url, depth))
+        elif url not in self.seen:
+            queue_.append((url, depth))
+        self.seen.add(url)
+    
+    def _follow(self, url):
+        # 只跟隨同網站、看起來是網頁的網址
+        if site_of(url) not in self.sites:
+            return False
+        return not urlsplit(url).path.lower().endswith(CRAWL_SKIP_EXTENSIONS)
+    
+    def load_checkpoint(self):
+        """從檢查點還原未完成的爬取，回傳是否已還原"""
+        if not self.checkpoint:
+            return False
+        try:
+            with open(self.checkpoint, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return False
+        # 起始網址不同或上次已經爬完時重新開始
+        if state.get('seeds') != self.seeds or not state.get('frontier'):
+            return False
+        self.queues.clear()
+        self.seen = set(state['seen'])
+        for url, depth in state['frontier']:
+            self.queues.setdefault(urlsplit(url).netloc, deque()).append((url, depth))
+        self.links = list(state['links'])
+        self.link_set = set(self.links)
+        self.pages_done = state['pages_done']
+        self.errors = state['errors']
+        return True
+    
+    def save_checkpoint(self, in_flight=()):
+        """寫入檢查點；抓取中的網址記為待抓取，繼續時會重新抓取"""
+        if not self.checkpoint:
+            return
+        frontier = [[url, depth] for url, depth in in_flight]
+        for queue_ in self.queues.values():
+            frontier.extend([url, depth] for url, depth in queue_)
+        state = {
+            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+            "seeds": self.seeds,
+            "pages_done": self.pages_done,
+            "errors": self.errors,
+            "frontier": frontier,
+            "seen": sorted(self.seen),
+            "links": self.links,
+        }
+        # 中途被中斷也不會留下損壞的檢查點
+        os.makedirs(os.path.dirname(self.checkpoint) or '.', exist_ok=True)
+        with atomic_write(self.checkpoint, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+    
+    def _fetch_page(self, session, url, cancel):
+        # 在工作執行緒中下載並解析一個頁面，回傳 (結果, 轉址後的網址, 頁面中的連結)；已取消時回傳 None
+        start = time.perf_counter()
+        anchors = []
+        try:
+            if cancel is not None and cancel.is_set():
+                return None
+            with open_url(url, session, timeout=self.timeout) as response:
+                response.raise_for_status()
+                final_url = normalize_url(response.url) or url
+                content_type = response.headers.get('Content-Type', '').lower()
+                if site_of(final_url) not in self.sites or (content_type and 'html' not in content_type):
+                    # 轉址到其他網站或不是網頁，不解析
+                    return ExtractionResult(url, elapsed=time.perf_counter() - start), final_url, []
+                chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+                if cancel is not None:
+                    chunks = _cancellable(chunks, cancel)
+                links = scan_cctv_links(chunks, response.encoding or 'utf-8', on_anchor=anchors.append)
+            links = list(dict.fromkeys(urljoin(final_url, link) for link in links))
+            return ExtractionResult(url, links, elapsed=time.perf_counter() - start), final_url, anchors
+        except ExtractionCancelled:
+            return None
+        except Exception as e:
+            return ExtractionResult(url, error=str(e), elapsed=time.perf_counter() - start), url, []
+    
+    def run(self, on_link=None, on_batch=None, on_page=None, cancel=None, session=None):
+        """執行爬取，回傳本次抓取的 ExtractionResult 列表（每個頁面一筆）
+        
+        on_link 於找到新連結時呼叫；on_batch 於每次寫入檢查點前收到這段期間的新連結，可用來分批寫入連結資料庫；
+        on_page 於每個頁面完成時收到其結果。回呼都在呼叫 run 的執行緒中執行。
+        cancel 為 threading.Event，設定後不再發出新請求，等待抓取中的頁面結束並寫入檢查點。
+        沒有指定 session 時經由共用的上游連線層（同時受其流量限制與斷路器影響）。
+        """
+        results = []
+        batch = []
+        in_flight = {}  # future -> (網址, 深度)
+        host_active = {}  # 主機 -> 抓取中的頁面數
+        host_next = {}  # 主機 -> 下次可以發出請求的時間
+        since_checkpoint = 0
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crawl')
+        try:
+            while True:
+                cancelled = cancel is not None and cancel.is_set()
+                now = time.monotonic()
+                next_ready = None
+                for host in [] if cancelled else list(self.queues):
+                    queue_ = self.queues[host]
+                    while (queue_ and len(in_flight) < self.workers and host_active.get(host, 0) < self.per_host
+                           and self.pages_done + len(in_flight) < self.max_pages):
+                        if host_next.get(host, 0) > now:
+                            # 同一主機的請求間隔未到
+                            next_ready = min(next_ready or host_next[host], host_next[host])
+                            break
+                        url, depth = queue_.popleft()
+                        host_active[host] = host_active.get(host, 0) + 1
+                        host_next[host] = now + self.delay
+                        in_flight[executor.submit(self._fetch_page, session, url, cancel)] = (url, depth)
+                    if not queue_:
+                        del self.queues[host]
+                
+                if not in_flight:
+                    if next_ready is None:
+                        # 已爬完、達到頁面上限或已取消
+                        break
+                    if cancel is not None:
+                        cancel.wait(next_ready - now)
+                    else:
+                        time.sleep(next_ready - now)
+                    continue
+                
+                timeout = None if next_ready is None else max(next_ready - now, 0)
+                done, _ = wait_futures(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, depth = in_flight.pop(future)
+                    host_active[urlsplit(url).netloc] -= 1
+                    outcome = future.result()
+                    if outcome is None:
+                        # 被取消的頁面放回佇列，繼續時重新抓取
+                        self._enqueue(url, depth, front=True)
+                        continue
+                    result, final_url, anchors = outcome
+                    self.pages_done += 1
+                    since_checkpoint += 1
+                    if result.ok:
+                        self.seen.add(final_url)
+                        new_links = [link for link in result.links if link not in self.link_set]
+                        self.link_set.update(new_links)
+                        self.links.extend(new_links)
+                        batch.extend(new_links)
+                        if on_link is not None:
+                            for link in new_links:
+                                on_link(link)
+                        if depth < self.max_depth:
+                            for href in anchors:
+                                link = normalize_url(href, final_url)
+                                if link and self._follow(link):
+                                    self._enqueue(link, depth + 1)
+                    else:
+                        self.errors += 1
+                    metrics.inc('cctv_crawl_pages_total', outcome='ok' if result.ok else 'error')
+                    results.append(result)
+                    if on_page is not None:
+                        on_page(result)
+                
+                if since_checkpoint >= CRAWL_CHECKPOINT_EVERY:
+                    self._flush(batch, on_batch, in_flight.values())
+                    since_checkpoint = 0
+            
+            self._flush(batch, on_batch)
+            if not self.queues and self.checkpoint:
+                # 已經爬完，不再需要檢查點
+                try:
+                    os.remove(self.checkpoint)
+                except OSError:
+                    pass
+            return results
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _flush(self, batch, on_batch, in_flight=()):
+        # 先交出新連結再寫入檢查點：中途失敗時最多重複寫入已存在的連結
+        if batch and on_batch is not None:
+            on_batch(list(batch))
+        batch.clear()
+        self.save_checkpoint(in_flight)
@@ -0,0 +1,130 @@
+"""
+以 Server-Sent Events 推播連結、存活狀態與畫面的變化
+"""
+
+import json
+import queue
+import threading
+from cctv.core import metrics
+from cctv import proxy
+
+# 推播設定
+EVENT_QUEUE_SIZE = 64  # 每個訂閱者最多暫存的事件數，超過時清空並要求客戶端重新同步
+EVENT_POLL_INTERVAL = 1.0  # 檢查變化並推播的間隔（秒），同一段時間內的畫面更新合併為一個事件
+EVENT_KEEPALIVE = 15  # 沒有事件時送出註解行的間隔（秒），避免代理伺服器切斷連線
+EVENT_RETRY_MS = 3000  # 客戶端斷線後重新連線的等待時間（毫秒）
+
+metrics.describe('cctv_events_total', 'counter', '推播的事件數（依事件類型）')
+
+class EventBus:
+    """伺服器推播（Server-Sent Events）的訂閱管理
+    
+    每個訂閱者有固定大小的佇列；慢速客戶端的佇列滿了就清空並改送 resync 事件，
+    不會因為客戶端太慢而佔用越來越多記憶體。
+    """
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.subscribers = set()
+    
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+    
+    def publish(self, event, data):
+        metrics.inc('cctv_events_total', event=event)
+        payload = format_event(event, data)
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(payload)
+            except queue.Full:
+                # 漏掉的事件無法補送，請客戶端重新取得完整狀態
+                while True:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        break
+                subscriber.put_nowait(format_event('resync', {}))
+
+def format_event(event, data):
+    """組成一則 SSE 訊息"""
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'.encode('utf-8')
+
+class ChangeNotifier:
+    """定期檢查連結、攝影機狀態與畫面世代，有變化時才推播
+    
+    links：cctv_links.json 的版本改變（包含程式內儲存與外部修改）
+    health：攝影機存活狀態改變，pages 為受影響的頁碼
+    frames：這段時間內畫面有變化的攝影機 {識別碼: 畫面世代}
+    """
+    def __init__(self, bus, interval=EVENT_POLL_INTERVAL):
+        self.bus = bus
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending_frames = {}  # 攝影機識別碼 -> 畫面世代
+        self.version = None
+        self.health_generation = None
+        self.page_health = []
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def on_frame(self, cam_id, frame):
+        """FrameCache 的畫面監聽器"""
+        with self.lock:
+            self.pending_frames[cam_id] = frame.generation
+    
+    def state(self):
+        """目前的狀態，客戶端連線時先送出"""
+        return {"version": proxy.link_index.current_version(), "health": proxy.health_prober.generation}
+    
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"推播錯誤: {e}")
+    
+    def poll(self):
+        version = proxy.link_index.current_version()
+        if version != self.version:
+            if self.version is not None:
+                self.bus.publish('links', {"version": version})
+            self.version = version
+            self.page_health = proxy.link_index.page_health()
+        
+        generation = proxy.health_prober.generation
+        if generation != self.health_generation:
+            page_health = proxy.link_index.page_health()
+            changed = [index for index, key in enumerate(page_health)
+                       if index >= len(self.page_health) or self.page_health[index] != key]
+            if self.health_generation is not None and changed:
+                self.bus.publish('health', {"generation": generation, "pages": changed})
+            self.health_generation = generation
+            self.page_health = page_health
+        
+        with self.lock:
+            frames, self.pending_frames = self.pending_frames, {}
+        if frames and self.bus.subscribers:
+            self.bus.publish('frames', {"frames": frames})
+
+event_bus = EventBus()
+change_notifier = ChangeNotifier(event_bus)
+proxy.frame_cache.listeners.append(change_notifier.on_frame)
+metrics.gauge('cctv_event_subscribers', '推播連線數', lambda: len(event_bus.subscribers))
@@ -0,0 +1,327 @@
+"""
+從來源網頁提取 CCTV 圖片連結（串流解析、條件式請求快取與批次提取）
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import json
+import codecs
+import hashlib
+from collections import OrderedDict
+from html.parser import HTMLParser
+import os
+import threading
+import time
+from cctv.core import (CACHE_DIR_NAME, CHUNK_SIZE, DEFAULT_TIMEOUT, DEFAULT_WORKERS, atomic_write,
+                       get_app_dir, metrics, open_url)
+
+# 提取設定
+DEFAULT_BACKEND = 'stream'  # 預設的解析方式
+CACHE_MAX_BYTES = 16 * 1024 * 1024  # 快取大小上限
+
+metrics.describe('cctv_extract_requests_total', 'counter', '提取的來源網址數（依結果分類）')
+metrics.describe('cctv_extract_fetch_seconds', 'histogram', '下載來源頁面所花的時間（含等待回應）')
+metrics.describe('cctv_extract_parse_seconds', 'histogram', '解析來源頁面所花的時間')
+metrics.describe('cctv_extract_bytes_total', 'counter', '下載的來源頁面位元組數')
+metrics.describe('cctv_extract_links_total', 'counter', '找到的 CCTV 連結數')
+
+@dataclass
+class ExtractionResult:
+    """單一網址的提取結果"""
+    url: str
+    links: list = field(default_factory=list)
+    error: str = None
+    elapsed: float = 0.0
+    cache_status: str = None  # None、'not_modified'（304）或 'unchanged'（內容雜湊相同）
+
+    @property
+    def ok(self):
+        return self.error is None
+
+def parse_cctv_links(html):
+    """從 HTML 中找出所有 class="cctv-image" 的 img 標籤並回傳 src（BeautifulSoup 參考實作）"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    links = []
+    for img in soup.find_all('img', class_='cctv-image'):
+        if 'src' in img.attrs:
+            links.append(img['src'])
+    return links
+
+# 爬取時跟隨的標籤與屬性
+ANCHOR_ATTRS = {'a': 'href', 'area': 'href', 'frame': 'src', 'iframe': 'src'}
+
+class CCTVImageParser(HTMLParser):
+    """逐段解析 HTML，只記錄 img.cctv-image 的 src，不建立文件樹
+    
+    提供 on_anchor 時也會回報頁面中的超連結與框架網址（供爬取使用）。
+    """
+    def __init__(self, on_link=None, on_anchor=None):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self.on_link = on_link
+        self.on_anchor = on_anchor
+    
+    def handle_starttag(self, tag, attrs):
+        if self.on_anchor is not None and tag in ANCHOR_ATTRS:
+            for key, value in attrs:
+                if key == ANCHOR_ATTRS[tag] and value:
+                    self.on_anchor(value)
+            return
+        if tag != 'img':
+            return
+        # 與 BeautifulSoup 相同：重複屬性以最後一個為準，無值屬性視為空字串
+        attr_dict = {}
+        for key, value in attrs:
+            attr_dict[key] = '' if value is None else value
+        classes = attr_dict.get('class')
+        if classes is None or 'src' not in attr_dict:
+            return
+        if 'cctv-image' not in classes.split() and classes != 'cctv-image':
+            return
+        link = attr_dict['src']
+        self.links.append(link)
+        if self.on_link is not None:
+            self.on_link(link)
+
+def scan_cctv_links(chunks, encoding='utf-8', on_link=None, on_anchor=None):
+    """將位元組區塊逐段解碼並掃描，不保留完整內容"""
+    parser = CCTVImageParser(on_link, on_anchor)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    for chunk in chunks:
+        if chunk:
+            parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    return parser.links
+
+class SourcePageCache:
+    """來源頁面的磁碟快取：記錄 ETag/Last-Modified、內容雜湊與提取結果，超過上限時淘汰最久未用的項目"""
+    def __init__(self, directory=None, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory or os.path.join(get_app_dir(), CACHE_DIR_NAME)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 檔名 -> 檔案大小，依使用時間排序
+        self.total_bytes = 0
+        os.makedirs(self.directory, exist_ok=True)
+        
+        # 以檔案修改時間還原 LRU 順序
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                st = os.stat(os.path.join(self.directory, name))
+                files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_bytes += size
+    
+    def _name(self, url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json'
+    
+    def get(self, url):
+        name = self._name(url)
+        path = os.path.join(self.directory, name)
+        with self.lock:
+            if name not in self.entries:
+                return None
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                os.utime(path)
+            except (OSError, json.JSONDecodeError):
+                self._remove(name)
+                return None
+            self.entries.move_to_end(name)
+        return entry if entry.get('url') == url else None
+    
+    def put(self, url, entry):
+        name = self._name(url)
+        path = os.path.join(self.directory, name)
+        data = json.dumps(dict(entry, url=url), ensure_ascii=False).encode('utf-8')
+        with self.lock:
+            # 避免留下不完整的快取
+            with atomic_write(path, 'wb') as f:
+                f.write(data)
+            self.total_bytes += len(data) - self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            
+            # 超過上限時淘汰最久未使用的項目
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                self._remove(next(iter(self.entries)))
+    
+    def _remove(self, name):
+        self.total_bytes -= self.entries.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+source_cache = None  # 共用的來源頁面快取
+
+def get_source_cache():
+    """取得共用的來源頁面快取"""
+    global source_cache
+    if source_cache is None:
+        source_cache = SourcePageCache()
+    return source_cache
+
+def _hashing(chunks, hasher):
+    # 在串流過程中同時計算內容雜湊
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
+class ExtractionCancelled(Exception):
+    """提取被使用者取消"""
+
+def _metered(chunks, timing):
+    # 記錄下載的位元組數與等待資料的時間，其餘時間即為解析時間
+    iterator = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            timing['wait'] += time.perf_counter() - start
+            return
+        timing['wait'] += time.perf_counter() - start
+        timing['bytes'] += len(chunk)
+        yield chunk
+
+def _cancellable(chunks, cancel):
+    # 每個區塊之間檢查是否已取消
+    for chunk in chunks:
+        if cancel.is_set():
+            raise ExtractionCancelled("已取消")
+        yield chunk
+
+def _extract_stream(response, chunks, on_link=None):
+    # 串流解析：邊下載邊掃描，找到連結就立即回報
+    # 未宣告編碼時以 UTF-8 解碼（參考實作則會整份內容猜測編碼）
+    return scan_cctv_links(chunks, response.encoding or 'utf-8', on_link)
+
+def _extract_bs4(response, chunks, on_link=None):
+    # 參考實作：下載完整內容後建立 BeautifulSoup 文件樹（解碼方式與 response.text 相同）
+    import requests
+    content = b''.join(chunks)
+    encoding = response.encoding or requests.compat.chardet.detect(content)['encoding'] or 'utf-8'
+    links = parse_cctv_links(str(content, encoding, errors='replace'))
+    if on_link is not None:
+        for link in links:
+            on_link(link)
+    return links
+
+# 可選用的解析方式
+EXTRACTOR_BACKENDS = {
+    'stream': _extract_stream,
+    'bs4': _extract_bs4,
+}
+
+def fetch_links(url, session=None, timeout=DEFAULT_TIMEOUT, backend=DEFAULT_BACKEND, cache=None,
+                on_link=None, cancel=None):
+    """提取單一網址的 CCTV 連結，錯誤會記錄在結果中而不會拋出
+    
+    提供 cache 時會送出條件式請求，304 時直接沿用上次的結果；內容雜湊未變時也沿用上次的結果（仍會邊下載邊解析）。
+    on_link 會在每找到一個連結時被呼叫（可能來自其他執行緒）；cancel 為 threading.Event，設定後停止下載。
+    """
+    start = time.perf_counter()
+    timing = {'wait': 0.0, 'bytes': 0}
+    try:
+        if cancel is not None and cancel.is_set():
+            raise ExtractionCancelled("已取消")
+        extractor = EXTRACTOR_BACKENDS[backend]
+        entry = cache.get(url) if cache is not None else None
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        
+        cache_status = None
+        with open_url(url, session, headers, timeout) as response:
+            body_start = time.perf_counter()
+            chunks = _metered(response.iter_content(chunk_size=CHUNK_SIZE), timing)
+            if cancel is not None:
+                chunks = _cancellable(chunks, cancel)
+            if response.status_code == 304 and entry:
+                # 頁面未變更，沿用上次的連結
+                links = entry['links']
+                body_hash = entry.get('body_hash')
+                cache_status = 'not_modified'
+            else:
+                response.raise_for_status()
+                if cache is None:
+                    links = extractor(response, chunks, on_link)
+                    body_hash = None
+                else:
+                    # 邊解析邊計算雜湊，不保留完整內容；找到的連結已經即時回報
+                    hasher = hashlib.sha256()
+                    links = extractor(response, _hashing(chunks, hasher), on_link)
+                    body_hash = hasher.hexdigest()
+                    if entry and body_hash == entry.get('body_hash'):
+                        # 內容與上次相同，沿用快取的結果
+                        links = entry['links']
+                        cache_status = 'unchanged'
+            if cache_status == 'not_modified' and on_link is not None:
+                for link in links:
+                    on_link(link)
+        
+        # 下載時間 = 等待回應標頭 + 等待內容；讀取內容期間的其餘時間為解析時間
+        parse_time = time.perf_counter() - body_start - timing['wait']
+        metrics.inc('cctv_extract_requests_total', backend=backend, outcome=cache_status or 'ok')
+        metrics.observe('cctv_extract_fetch_seconds', body_start - start + timing['wait'], backend=backend)
+        if cache_status != 'not_modified':
+            metrics.observe('cctv_extract_parse_seconds', max(parse_time, 0.0), backend=backend)
+        metrics.inc('cctv_extract_bytes_total', timing['bytes'], backend=backend)
+        metrics.inc('cctv_extract_links_total', len(links), backend=backend)
+        
+        if cache is not None:
+            cache.put(url, {
+                'etag': response.headers.get('ETag') or (entry or {}).get('etag'),
+                'last_modified': response.headers.get('Last-Modified') or (entry or {}).get('last_modified'),
+                'body_hash': body_hash,
+                'links': links,
+            })
+        return ExtractionResult(url, links, elapsed=time.perf_counter() - start, cache_status=cache_status)
+    except Exception as e:
+        outcome = 'cancelled' if isinstance(e, ExtractionCancelled) else 'error'
+        metrics.inc('cctv_extract_requests_total', backend=backend, outcome=outcome)
+        return ExtractionResult(url, error=str(e), elapsed=time.perf_counter() - start)
+
+def merge_links(results):
+    """合併多個提取結果並去除重複連結（保留出現順序）"""
+    seen = set()
+    merged = []
+    for result in results:
+        for link in result.links:
+            if link not in seen:
+                seen.add(link)
+                merged.append(link)
+    return merged
+
+def extract_links_batch(urls, max_workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, session=None,
+                        backend=DEFAULT_BACKEND, cache=None, on_link=None, cancel=None):
+    """同時提取多個網址，回傳與輸入順序相同的 ExtractionResult 列表（on_link、cancel 同 fetch_links）
+    
+    沒有指定 session 時經由共用的上游連線層，同一主機的請求受其流量限制。
+    """
+    # 去除重複的來源網址
+    urls = list(dict.fromkeys(u.strip() for u in urls if u.strip()))
+    if not urls:
+        return []
+    
+    max_workers = max(1, min(max_workers, len(urls)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            lambda u: fetch_links(u, session, timeout, backend, cache, on_link, cancel), urls))
+
+def read_url_list(path):
+    """讀取網址清單檔案（每行一個網址，# 開頭為註解）"""
+    urls = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                urls.append(line)
+    return urls
@@ -0,0 +1,155 @@
+"""
+向攝影機取得單張畫面與解析 MJPEG 串流
+"""
+
+import re
+import hashlib
+import time
+from cctv.core import CHUNK_SIZE, UpstreamUnavailable, metrics
+from cctv import core
+
+metrics.describe('cctv_upstream_seconds', 'histogram', '向攝影機取圖或檢查的時間')
+metrics.describe('cctv_upstream_requests_total', 'counter', '向攝影機發出的請求數')
+
+# 取圖設定
+MAX_FRAME_BYTES = 8 * 1024 * 1024  # 單張畫面大小上限
+SNAPSHOT_TIMEOUT = 10  # 向上游取圖的逾時秒數
+
+def camera_id(url):
+    """由攝影機網址產生固定的識別碼"""
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+
+def is_mjpeg_url(url):
+    """依網址判斷是否為 MJPEG 串流"""
+    return bool(re.search(r'mjpe?g', url, re.IGNORECASE))
+
+def read_first_jpeg(chunks, max_bytes=MAX_FRAME_BYTES):
+    """從 MJPEG 串流中讀出第一張完整的 JPEG"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        start = buffer.find(b'\xff\xd8')
+        if start >= 0:
+            end = buffer.find(b'\xff\xd9', start + 2)
+            if end >= 0:
+                return bytes(buffer[start:end + 2])
+        if len(buffer) > max_bytes:
+            break
+    raise ValueError("串流中沒有完整的 JPEG 畫面")
+
+def fetch_frame(url, timeout=SNAPSHOT_TIMEOUT, background=False):
+    """向上游取得一張畫面，回傳 (內容, Content-Type)；background 的請求不佔用觀看中的請求需要的權杖"""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        result = _fetch_frame(url, timeout, background)
+        outcome = 'ok'
+        return result
+    except UpstreamUnavailable:
+        outcome = 'rejected'
+        raise
+    finally:
+        metrics.inc('cctv_upstream_requests_total', kind='snapshot', outcome=outcome)
+        metrics.observe('cctv_upstream_seconds', time.perf_counter() - start, kind='snapshot')
+
+def _fetch_frame(url, timeout, background):
+    with core.upstream.get(url, timeout=timeout, background=background) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', 'image/jpeg')
+        if content_type.startswith('multipart/'):
+            # MJPEG 串流只取第一張畫面
+            return read_first_jpeg(response.iter_content(chunk_size=CHUNK_SIZE)), 'image/jpeg'
+        return read_frame_body(response), content_type
+
+def read_frame_body(response):
+    """讀取單張畫面的完整內容，超過 MAX_FRAME_BYTES 時拋出 ValueError"""
+    data = bytearray()
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        data += chunk
+        if len(data) > MAX_FRAME_BYTES:
+            raise ValueError("畫面超過大小上限")
+    return bytes(data)
+
+class MultipartJPEGParser:
+    """解析 multipart/x-mixed-replace 串流
+    
+    資料累積在同一個 bytearray 中，以位移量記錄讀取位置，
+    只有取出完整畫面時才複製一次。
+    """
+    HEADER_END = re.compile(rb'\r?\n\r?\n')
+    CONTENT_LENGTH = re.compile(rb'content-length:[ \t]*(\d+)', re.IGNORECASE)
+    
+    def __init__(self, boundary, max_frame_bytes=MAX_FRAME_BYTES):
+        # 有些攝影機宣告的 boundary 已含 "--"，因此只比對去掉連字號後的部分
+        self.boundary = boundary.strip('"').lstrip('-').encode('latin-1')
+        self.max_frame_bytes = max_frame_bytes
+        self.buffer = bytearray()
+        self.pos = 0
+    
+    def feed(self, chunk):
+        """加入新資料，回傳已完成的畫面列表"""
+        self.buffer += chunk
+        frames = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        
+        # 已處理的資料過多時才壓縮緩衝區
+        if self.pos > len(self.buffer) // 2:
+            del self.buffer[:self.pos]
+            self.pos = 0
+        if len(self.buffer) - self.pos > self.max_frame_bytes:
+            raise ValueError("MJPEG 畫面超過大小上限")
+        return frames
+    
+    def _next_frame(self):
+        buffer = self.buffer
+        start = buffer.find(self.boundary, self.pos)
+        if start < 0:
+            return None
+        header_match = self.HEADER_END.search(buffer, start + len(self.boundary))
+        if header_match is None:
+            return None
+        body_start = header_match.end()
+        
+        length_match = self.CONTENT_LENGTH.search(buffer, start, header_match.start())
+        if length_match is not None:
+            body_end = body_start + int(length_match.group(1))
+            if body_end > len(buffer):
+                return None
+            self.pos = body_end
+        else:
+            # 沒有 Content-Length 時以下一個 boundary 作為結尾
+            next_start = buffer.find(self.boundary, body_start)
+            if next_start < 0:
+                return None
+            body_end = next_start
+            while body_end > body_start and buffer[body_end - 1] == 0x2d:  # '-'
+                body_end -= 1
+            while body_end > body_start and buffer[body_end - 1] in (0x0a, 0x0d):
+                body_end -= 1
+            self.pos = next_start
+        
+        with memoryview(buffer) as view:
+            return bytes(view[body_start:body_end])
+
+def iter_available(response):
+    """串流讀取已到達的資料，不必等到湊滿整個區塊（避免畫面延遲一張）"""
+    read1 = getattr(response.raw, 'read1', None)
+    if read1 is None:
+        # 舊版 urllib3 沒有 read1，改用較小的區塊
+        yield from response.iter_content(chunk_size=4096)
+        return
+    while True:
+        chunk = read1(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+def _multipart_boundary(content_type):
+    match = re.search(r'boundary=("?)([^";]+)\1', content_type)
+    if match is None:
+        raise ValueError("串流缺少 boundary")
+    return match.group(2)
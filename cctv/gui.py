@@ -0,0 +1,620 @@
+"""
+圖形介面（tkinter 只在這裡匯入）
+"""
+
+from threading import Thread
+import queue
+import threading
+from cctv.core import METRIC_BUCKETS, metrics
+from cctv.extract import extract_links_batch, fetch_links, get_source_cache, read_url_list
+from cctv.crawler import SiteCrawler, crawl_checkpoint_path
+from cctv.store import LINKS_FILE, PAGE_SIZE, LinkEditorModel, get_link_store
+from cctv.frames import camera_id
+from cctv import proxy, server
+
+# 圖形介面設定
+STATS_REFRESH_MS = 2000  # 狀態列統計的更新間隔（毫秒）
+RESULT_DRAIN_MS = 100  # 介面每隔多久取出一批提取結果（毫秒）
+RESULT_BATCH_SIZE = 500  # 每次最多插入的連結數，避免單次更新卡住介面
+
+def _load_gui_modules():
+    """匯入圖形介面需要的模組（命令列模式不會載入）"""
+    global tk, ttk, scrolledtext, messagebox, filedialog, webbrowser
+    import tkinter as tk
+    from tkinter import ttk, scrolledtext, messagebox, filedialog
+    import webbrowser
+
+class LinkExtractorGUI:     
+    def __init__(self, root):
+        self.root = root
+        self.root.title("CCTV 圖片連結提取器")
+        self.root.geometry("800x600")
+        
+        # 創建主框架
+        self.main_frame = ttk.Frame(root, padding="10")
+        self.main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # URL 輸入區域
+        self.url_frame = ttk.Frame(self.main_frame)
+        self.url_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        self.url_label = ttk.Label(self.url_frame, text="網址:")
+        self.url_label.pack(side=tk.LEFT)
+        
+        self.url_entry = ttk.Entry(self.url_frame)
+        self.url_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(5, 5))
+        
+        self.extract_button = ttk.Button(
+            self.url_frame, 
+            text="提取結",
+            command=self.start_extraction
+        )
+        self.extract_button.pack(side=tk.LEFT)
+        
+        # 從檔案載入網址清單進行批次提取
+        self.load_urls_button = ttk.Button(
+            self.url_frame, 
+            text="載入清單",
+            command=self.load_url_file
+        )
+        self.load_urls_button.pack(side=tk.LEFT, padx=(5, 0))
+        
+        # 勾選時從輸入的網址爬取同網站的所有頁面
+        self.crawl_var = tk.BooleanVar(value=False)
+        self.crawl_check = ttk.Checkbutton(self.url_frame, text="爬取整站", variable=self.crawl_var)
+        self.crawl_check.pack(side=tk.LEFT, padx=(5, 0))
+        
+        # 取消提取按鈕
+        self.cancel_button = ttk.Button(
+            self.url_frame,
+            text="取消",
+            command=self.cancel_extraction,
+            state=tk.DISABLED
+        )
+        self.cancel_button.pack(side=tk.LEFT, padx=(5, 0))
+        
+        # 提取結果由背景執行緒放入佇列，主執行緒定期分批取出
+        self.result_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.found_links = []
+        self.found_set = set()
+        
+        # 進度條
+        self.progress = ttk.Progressbar(
+            self.main_frame,
+            mode='indeterminate'
+        )
+        
+        # 結顯示區域
+        self.result_frame = ttk.LabelFrame(self.main_frame, text="提取結果", padding="5")
+        self.result_frame.pack(fill=tk.BOTH, expand=True)
+        
+        self.result_text = scrolledtext.ScrolledText(
+            self.result_frame,
+            wrap=tk.WORD,
+            width=40,
+            height=10
+        )
+        self.result_text.pack(fill=tk.BOTH, expand=True)
+        
+        # 為文字區域添加點擊事件
+        self.result_text.tag_configure("hyperlink", foreground="blue", underline=1)
+        self.result_text.tag_bind("hyperlink", "<Button-1>", self.open_link)
+        self.result_text.tag_bind("hyperlink", "<Enter>", lambda e: self.result_text.configure(cursor="hand2"))
+        self.result_text.tag_bind("hyperlink", "<Leave>", lambda e: self.result_text.configure(cursor=""))
+        
+        # 為輸入框加入右鍵選單
+        self.create_right_click_menu()
+        
+        # 狀態列：左側為操作狀態，右側為伺服器與提取的統計
+        self.status_frame = ttk.Frame(self.main_frame)
+        self.status_frame.pack(fill=tk.X, pady=(5, 0))
+        
+        self.status_label = ttk.Label(
+            self.status_frame,
+            text="就緒",
+            anchor=tk.W
+        )
+        self.status_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        self.stats_label = ttk.Label(
+            self.status_frame,
+            anchor=tk.E,
+            foreground="gray"
+        )
+        self.stats_label.pack(side=tk.RIGHT)
+        self.update_stats()
+        
+        # 添加存按鈕
+        self.save_button = ttk.Button(
+            self.url_frame, 
+            text="儲存結果",
+            command=self.save_results,
+            state=tk.DISABLED
+        )
+        self.save_button.pack(side=tk.LEFT, padx=(5, 0))
+        
+        self.current_links = []  # 儲存當前的連結
+        
+        # 添加編輯 JSON 按鈕
+        self.edit_json_button = ttk.Button(
+            self.url_frame, 
+            text="編輯JSON",
+            command=self.open_json_editor
+        )
+        self.edit_json_button.pack(side=tk.LEFT, padx=(5, 0))
+        
+        # 添加開啟 HTML 鈕
+        self.open_html_button = ttk.Button(
+            self.url_frame, 
+            text="開啟監視器",
+            command=self.open_html_viewer
+        )
+        self.open_html_button.pack(side=tk.LEFT, padx=(5, 0))
+        
+        # 伺服器在背景啟動，視窗不必等待；就緒後開啟監視器頁面
+        Thread(target=self.open_viewer, daemon=True).start()
+    
+    def update_stats(self):
+        # 定期更新狀態列右側的精簡統計（完整指標見 /metrics）
+        def fmt(seconds):
+            if seconds is None:
+                return "-"
+            if seconds == float('inf'):
+                return f">{METRIC_BUCKETS[-1]:.0f}s"
+            return f"{seconds * 1000:.0f}ms"
+        
+        requests_total = metrics.counter_total('cctv_http_requests_total')
+        server_errors = metrics.counter_total('cctv_http_requests_total', lambda labels: labels['status'].startswith('5'))
+        extracted = metrics.counter_total('cctv_extract_requests_total')
+        links = metrics.counter_total('cctv_extract_links_total')
+        self.stats_label.config(text=(
+            f"請求 {requests_total}（5xx {server_errors}）p95 {fmt(metrics.quantile('cctv_http_request_seconds', 0.95))}"
+            f"｜上游 p95 {fmt(metrics.quantile('cctv_upstream_seconds', 0.95))}"
+            f"｜提取 {extracted} 個網址 {links} 連結"
+        ))
+        self.root.after(STATS_REFRESH_MS, self.update_stats)
+    
+    def open_viewer(self, path=''):
+        """啟動（或沿用）共用的伺服器並以瀏覽器開啟頁面，在背景執行緒中呼叫"""
+        try:
+            server.server_manager.start()
+            if not server.server_manager.wait_ready(5):
+                raise OSError("伺服器未就緒")
+            webbrowser.open(server.server_manager.url(path))
+        except Exception as e:
+            message = f"無法開啟監視器: {e}"
+            print(message)
+            self.root.after(0, lambda: self.status_label.config(text=message))
+    
+    def create_right_click_menu(self):
+        # 創建右鍵選單
+        self.right_click_menu = tk.Menu(self.root, tearoff=0)
+        self.right_click_menu.add_command(label="剪下", command=lambda: self.right_click_menu_action('cut'))
+        self.right_click_menu.add_command(label="複製", command=lambda: self.right_click_menu_action('copy'))
+        self.right_click_menu.add_command(label="貼上", command=lambda: self.right_click_menu_action('paste'))
+        
+        # 綁定右鍵事件到所有可編輯元件
+        self.url_entry.bind('<Button-3>', self.show_right_click_menu)
+        self.result_text.bind('<Button-3>', self.show_right_click_menu)
+        
+        # 為編輯器中的輸入框也添加右鍵選單
+        def bind_right_click_to_entries(entries):
+            for entry in entries:
+                entry.bind('<Button-3>', self.show_right_click_menu)
+    
+    def show_right_click_menu(self, event):
+        try:
+            self.right_click_menu.tk_popup(event.x_root, event.y_root)
+        finally:
+            self.right_click_menu.grab_release()
+    
+    def right_click_menu_action(self, action):
+        try:
+            focused = self.root.focus_get()
+            if action == 'cut':
+                focused.event_generate('<<Cut>>')
+            elif action == 'copy':
+                focused.event_generate('<<Copy>>')
+            elif action == 'paste':
+                focused.event_generate('<<Paste>>')
+        except:
+            pass
+    
+    def extract_links(self, url):
+        """提取單一網址，回傳 ExtractionResult"""
+        return fetch_links(url, cache=get_source_cache())
+    
+    def load_url_file(self):
+        path = filedialog.askopenfilename(
+            title="選擇網址清單",
+            filetypes=[("文字檔", "*.txt"), ("所有檔案", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            urls = read_url_list(path)
+        except Exception as e:
+            self.status_label.config(text=f"無法讀取清單: {str(e)}")
+            return
+        self.url_entry.delete(0, tk.END)
+        self.url_entry.insert(0, " ".join(urls))
+        self.start_extraction()
+    
+    def start_extraction(self):
+        # 清空結果
+        self.result_text.delete(1.0, tk.END)
+        # 允許以空白分隔輸入多個網址
+        urls = self.url_entry.get().split()
+        
+        if not urls:
+            self.status_label.config(text="請輸入網址")
+            return
+        
+        # 顯示進度條
+        self.progress.pack(fill=tk.X, pady=(0, 10))
+        self.progress.start()
+        self.extract_button.config(state=tk.DISABLED)
+        self.load_urls_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.save_button.config(state=tk.DISABLED)
+        crawl = self.crawl_var.get()
+        if crawl:
+            self.status_label.config(text=f"正在爬取網站（{len(urls)} 個起始網址）...")
+        else:
+            self.status_label.config(text=f"正在提取連結（{len(urls)} 個網址）...")
+        
+        # 每次提取使用新的佇列與取消旗標，舊的背景執行緒不會影響這次的結果
+        self.result_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.found_links = []
+        self.found_set = set()
+        
+        # 在新線程中執行提取
+        Thread(target=self.extraction_thread, args=(urls, self.result_queue, self.cancel_event, crawl),
+               daemon=True).start()
+        self.root.after(RESULT_DRAIN_MS, self.drain_results, self.result_queue)
+    
+    def cancel_extraction(self):
+        self.cancel_event.set()
+        self.cancel_button.config(state=tk.DISABLED)
+        self.status_label.config(text="正在取消...")
+    
+    def extraction_thread(self, urls, result_queue, cancel, crawl=False):
+        # 執行提取，找到的連結立即放入佇列
+        on_link = lambda link: result_queue.put(('link', link))
+        if crawl:
+            # 有未完成的檢查點時接續上次的進度，先送出先前找到的連結
+            crawler = SiteCrawler(urls, checkpoint=crawl_checkpoint_path(urls))
+            if crawler.load_checkpoint():
+                for link in crawler.links:
+                    on_link(link)
+            results = crawler.run(on_link=on_link, cancel=cancel)
+        elif len(urls) == 1:
+            results = [fetch_links(urls[0], cache=get_source_cache(), on_link=on_link, cancel=cancel)]
+        else:
+            results = extract_links_batch(urls, cache=get_source_cache(), on_link=on_link, cancel=cancel)
+        result_queue.put(('done', results))
+    
+    def drain_results(self, result_queue):
+        # 在主執行緒中分批取出結果，一次插入整批文字
+        if result_queue is not self.result_queue:
+            return
+        batch = []
+        done = None
+        while len(batch) < RESULT_BATCH_SIZE:
+            try:
+                kind, value = result_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'done':
+                done = value
+                break
+            if value not in self.found_set:
+                self.found_set.add(value)
+                batch.append(value)
+        
+        if batch:
+            self.found_links.extend(batch)
+            self.result_text.insert(tk.END, '\n'.join(batch) + '\n', "hyperlink")
+        
+        if done is not None:
+            self.update_results(done)
+        else:
+            if not self.cancel_event.is_set():
+                self.status_label.config(text=f"正在提取連結... 已找到 {len(self.found_links)} 個")
+            # 佇列還有資料時立即繼續，否則等待下一次
+            delay = 1 if len(batch) >= RESULT_BATCH_SIZE else RESULT_DRAIN_MS
+            self.root.after(delay, self.drain_results, result_queue)
+    
+    def update_results(self, results):
+        # 停止進度條
+        self.progress.stop()
+        self.progress.pack_forget()
+        self.extract_button.config(state=tk.NORMAL)
+        self.load_urls_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+        
+        links = self.found_links
+        errors = [r for r in results if not r.ok]
+        cancelled = self.cancel_event.is_set()
+        
+        # 顯示錯誤訊息（取消時不逐一列出）
+        if not cancelled:
+            for result in errors:
+                self.result_text.insert(tk.END, f"錯誤: {result.url} - {result.error}\n")
+        
+        # 已取消時保留目前找到的連結，仍可儲存
+        if links:
+            self.current_links = list(links)  # 儲存連結
+            status = f"成功提取 {len(links)} 個圖片連結"
+            if cancelled:
+                status = f"已取消，保留已找到的 {len(links)} 個圖片連結"
+            elif errors:
+                status += f"（{len(errors)}/{len(results)} 個網址失敗）"
+            self.status_label.config(text=status)
+            self.save_button.config(state=tk.NORMAL)  # 啟用儲存按鈕
+        elif cancelled:
+            self.status_label.config(text="已取消")
+            self.save_button.config(state=tk.DISABLED)
+        elif errors:
+            self.status_label.config(text="提取失敗")
+            self.save_button.config(state=tk.DISABLED)
+        else:
+            self.result_text.insert(tk.END, "沒有找到圖片連結")
+            self.status_label.config(text="未找到圖片連結")
+            self.save_button.config(state=tk.DISABLED)
+    
+    def save_results(self):
+        if not self.current_links:
+            return
+        
+        filename = LINKS_FILE
+        try:
+            # 寫入連結資料庫並匯出 JSON
+            store = get_link_store()
+            store.add_links(self.current_links)
+            total_links, total_pages = store.stats()
+            self.status_label.config(text=f"已更新 {filename}，共 {total_links} 個連結，{total_pages} 頁")
+            
+            # 清空當前連結列表
+            self.current_links = []
+            self.save_button.config(state=tk.DISABLED)
+        
+        except Exception as e:
+            self.status_label.config(text=f"儲存失敗: {str(e)}")
+
+    def open_link(self, event):
+        # 獲取點擊位置的行
+        index = self.result_text.index(f"@{event.x},{event.y}")
+        line_start = self.result_text.index(f"{index} linestart")
+        line_end = self.result_text.index(f"{index} lineend")
+        
+        # 獲取該行的連結
+        link = self.result_text.get(line_start, line_end).strip()
+        
+        # 如果連結不是以 http 開頭，加上 https://
+        if not link.startswith(('http://', 'https://')):
+            link = 'https://' + link
+            
+        # 開啟連結
+        try:
+            webbrowser.open(link)
+        except Exception as e:
+            self.status_label.config(text=f"無法開啟連結: {str(e)}")
+    
+    def open_json_editor(self):
+        editor_window = tk.Toplevel(self.root)
+        editor_window.title("編輯 JSON")
+        editor_window.geometry("800x600")
+        
+        # 只建立一頁的輸入框，切換頁面時重新填入內容
+        try:
+            model = LinkEditorModel(get_link_store())
+        except Exception as e:
+            messagebox.showerror("錯誤", str(e))
+            editor_window.destroy()
+            return
+        current_page = [0]  # 使用列表來儲存當前頁碼，以便在函數內部修改
+        
+        # 創建主框架
+        main_frame = ttk.Frame(editor_window, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # 分頁控制框架
+        page_control_frame = ttk.Frame(main_frame)
+        page_control_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        # 上一頁按鈕
+        prev_button = ttk.Button(
+            page_control_frame,
+            text="上一頁",
+            command=lambda: change_page(-1)
+        )
+        prev_button.pack(side=tk.LEFT)
+        
+        # 頁碼標籤
+        page_label = ttk.Label(page_control_frame, text="第 1 頁")
+        page_label.pack(side=tk.LEFT, padx=10)
+        
+        # 下一頁按鈕
+        next_button = ttk.Button(
+            page_control_frame,
+            text="下一頁",
+            command=lambda: change_page(1)
+        )
+        next_button.pack(side=tk.LEFT)
+        
+        # 跳到指定頁面
+        jump_entry = ttk.Entry(page_control_frame, width=6)
+        jump_entry.pack(side=tk.LEFT, padx=(20, 0))
+        jump_entry.bind('<Return>', lambda e: jump_to_page())
+        jump_button = ttk.Button(page_control_frame, text="前往", command=lambda: jump_to_page())
+        jump_button.pack(side=tk.LEFT, padx=(5, 0))
+        
+        # 搜尋連結（重複按下會找下一筆）
+        search_button = ttk.Button(page_control_frame, text="搜尋", command=lambda: search())
+        search_button.pack(side=tk.RIGHT)
+        search_entry = ttk.Entry(page_control_frame, width=24)
+        search_entry.pack(side=tk.RIGHT, padx=(0, 5))
+        search_entry.bind('<Return>', lambda e: search())
+        
+        # 連結列表框架
+        links_frame = ttk.LabelFrame(main_frame, text="連結列表", padding="5")
+        links_frame.pack(fill=tk.BOTH, expand=True)
+        
+        entries = []
+        health_labels = []
+        
+        for i in range(PAGE_SIZE):  # 每頁9個輸入框
+            row_frame = ttk.Frame(links_frame)
+            row_frame.pack(fill=tk.X, pady=2)
+            
+            # 連結輸入框
+            entry = ttk.Entry(row_frame)
+            entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+            # 綁定右鍵選單
+            entry.bind('<Button-3>', self.show_right_click_menu)
+            entries.append(entry)
+            
+            # 健康狀態
+            health_label = ttk.Label(row_frame, width=22, anchor=tk.W)
+            health_label.pack(side=tk.LEFT, padx=(5, 0))
+            health_labels.append(health_label)
+            
+            # 測試按鈕
+            test_button = ttk.Button(
+                row_frame,
+                text="測試",
+                command=lambda e=entry: test_link(e.get())
+            )
+            test_button.pack(side=tk.LEFT, padx=(5, 0))
+            
+            # 刪除按鈕
+            delete_button = ttk.Button(
+                row_frame,
+                text="刪除",
+                command=lambda e=entry: e.delete(0, tk.END)
+            )
+            delete_button.pack(side=tk.LEFT, padx=(5, 0))
+        
+        def show_health():
+            # 只更新目前顯示的頁面
+            for entry, label in zip(entries, health_labels):
+                link = entry.get().strip()
+                health = proxy.health_prober.status(camera_id(link)) if link else None
+                if not link:
+                    label.config(text="", foreground="")
+                elif health is None:
+                    label.config(text="未檢查", foreground="gray")
+                elif not health["alive"]:
+                    label.config(text="離線", foreground="red")
+                elif health["p50_ms"] is None:
+                    label.config(text="等待回應", foreground="orange")
+                else:
+                    label.config(
+                        text=f"正常 {health['p50_ms']:.0f}ms {health['availability']:.0%}",
+                        foreground="green"
+                    )
+        
+        def poll_health():
+            # 背景檢查持續進行，定期重新顯示
+            if editor_window.winfo_exists():
+                show_health()
+                editor_window.after(5000, poll_health)
+        
+        def update_page_label():
+            text = f"第 {current_page[0] + 1} / {len(model)} 頁"
+            if model.dirty:
+                text += f"（已修改 {len(model.dirty)} 頁）"
+            page_label.config(text=text)
+        
+        def store_page():
+            # 將輸入框內容寫回模型
+            model.set(current_page[0], [entry.get() for entry in entries])
+        
+        def show_page(index):
+            store_page()
+            current_page[0] = index % len(model)
+            for entry, link in zip(entries, model.get(current_page[0])):
+                entry.delete(0, tk.END)
+                entry.insert(0, link)
+            update_page_label()
+            show_health()
+        
+        def change_page(delta):
+            show_page(current_page[0] + delta)
+        
+        def jump_to_page():
+            try:
+                page = int(jump_entry.get())
+            except ValueError:
+                return
+            if 1 <= page <= len(model):
+                show_page(page - 1)
+        
+        def search():
+            store_page()
+            index = model.search(search_entry.get(), current_page[0])
+            if index is None:
+                messagebox.showinfo("搜尋", "找不到符合的連結", parent=editor_window)
+            else:
+                show_page(index)
+        
+        def test_link(url):
+            if url.strip():
+                webbrowser.open(url)
+        
+        def save_changes():
+            try:
+                store_page()
+                saved, skipped = model.save()
+                total_links, total_pages = get_link_store().stats()
+                message = f"已儲存 {saved} 個修改的頁面，共 {total_links} 個連結，{total_pages} 頁"
+                if skipped:
+                    message += f"\n略過 {skipped} 個重複的連結"
+                messagebox.showinfo("成功", message)
+                editor_window.destroy()
+                
+            except Exception as e:
+                messagebox.showerror("錯誤", str(e))
+        
+        # 按鈕框架
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        # 新增頁面按鈕
+        add_page_button = ttk.Button(
+            button_frame,
+            text="新增頁面",
+            command=lambda: show_page(model.add_page())
+        )
+        add_page_button.pack(side=tk.LEFT)
+        
+        # 儲存按鈕
+        save_button = ttk.Button(
+            button_frame,
+            text="儲存變更",
+            command=save_changes
+        )
+        save_button.pack(side=tk.RIGHT)
+        
+        # 顯示第一頁（輸入框尚為空白，不會被當成修改）
+        for entry, link in zip(entries, model.get(0)):
+            entry.insert(0, link)
+        update_page_label()
+        poll_health()
+    
+    def open_html_viewer(self):
+        # 與啟動時共用同一個伺服器
+        Thread(target=self.open_viewer, args=('index.html',), daemon=True).start()
+
+def run_gui():
+    _load_gui_modules()
+    root = tk.Tk()
+    app = LinkExtractorGUI(root)
+    try:
+        root.mainloop()
+    finally:
+        server.server_manager.stop()
+    return 0
@@ -0,0 +1,120 @@
+"""
+將一頁的攝影機畫面縮小合成為一張九宮格圖片
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+from collections import OrderedDict
+import threading
+import time
+from cctv.core import metrics
+from cctv.store import PAGE_SIZE
+from cctv.frames import camera_id
+from cctv.proxy import SingleFlight, get_snapshot
+from cctv import proxy
+
+# 合成圖設定
+MOSAIC_COLUMNS = 3  # 合成圖每列的畫面數（與 index.html 的九宮格相同）
+MOSAIC_TILE_WIDTH = 320  # 預設每格寬度（像素），高度依 16:9 計算
+MOSAIC_MIN_WIDTH = 80  # 客戶端可指定的每格寬度下限
+MOSAIC_MAX_WIDTH = 960  # 每格寬度上限
+MOSAIC_WIDTH_STEP = 80  # 每格寬度取整的單位，避免每種視窗大小都各自快取一份
+MOSAIC_QUALITY = 75  # JPEG 品質
+MOSAIC_CACHE_ENTRIES = 32  # 快取的合成圖數量
+MOSAIC_WORKERS = 16  # 合成時同時取圖的數量
+
+metrics.describe('cctv_mosaic_requests_total', 'counter', '合成圖請求數（依是否使用快取）')
+metrics.describe('cctv_mosaic_compose_seconds', 'histogram', '解碼、縮小並合成一張合成圖的時間')
+
+class MosaicBuilder:
+    """將一頁的攝影機畫面合成為一張縮小的 JPEG（需要 Pillow）
+    
+    各畫面經由快照快取平行取得，合成結果依頁面版本、各畫面內容與格子寬度快取，畫面沒有變化時不重新合成。
+    """
+    def __init__(self, max_entries=MOSAIC_CACHE_ENTRIES, workers=MOSAIC_WORKERS):
+        self.max_entries = max_entries
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # (頁碼, 格子寬度) -> (ETag, JPEG 內容)
+        self.flight = SingleFlight()
+        self.executor = None
+    
+    def _frames(self, cam_ids):
+        # 平行取得各攝影機的畫面；識別碼為 None（離線）或取圖失敗時沿用最後一張畫面
+        def load(cam_id):
+            if cam_id is None:
+                return None
+            try:
+                return get_snapshot(cam_id)
+            except Exception:
+                return proxy.frame_cache.peek(cam_id)
+        
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='mosaic')
+        return list(self.executor.map(load, cam_ids))
+    
+    def get(self, index, tile_width=MOSAIC_TILE_WIDTH):
+        """回傳 (ETag, JPEG 內容)，頁碼超出範圍時回傳 None；沒有安裝 Pillow 時拋出 ImportError"""
+        from PIL import Image  # 先確認可以合成，再向上游取圖
+        page = proxy.link_index.page_links(index)
+        if page is None:
+            return None
+        version, links = page
+        # 與 /api/pages 相同：離線的攝影機排在最後且不取圖
+        cam_ids = [camera_id(link) for link in links[:PAGE_SIZE]]
+        alive = {cam_id: proxy.health_prober.is_alive(cam_id) for cam_id in cam_ids}
+        cam_ids = [cam_id if alive[cam_id] else None for cam_id in sorted(cam_ids, key=lambda c: not alive[c])]
+        frames = self._frames(cam_ids)
+        
+        key = hashlib.sha1(f'{version}:{tile_width}'.encode('utf-8'))
+        for frame in frames:
+            key.update(frame.digest if frame is not None else b'-')
+        etag = f'"mo-{key.hexdigest()[:16]}"'
+        cache_key = (index, tile_width)
+        with self.lock:
+            cached = self.entries.get(cache_key)
+            if cached is not None and cached[0] == etag:
+                self.entries.move_to_end(cache_key)
+                metrics.inc('cctv_mosaic_requests_total', outcome='hit')
+                return cached
+        
+        # 多個客戶端同時要求同一張合成圖時只合成一次
+        data = self.flight.do(etag, lambda: self._compose(frames, tile_width))
+        with self.lock:
+            self.entries[cache_key] = (etag, data)
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return etag, data
+    
+    def _compose(self, frames, tile_width):
+        from PIL import Image
+        start = time.perf_counter()
+        tile_height = tile_width * 9 // 16
+        rows = -(-PAGE_SIZE // MOSAIC_COLUMNS)
+        # 格子之間留 1 像素的分隔線，與九宮格的外觀相同
+        size = (MOSAIC_COLUMNS * (tile_width + 1) - 1, rows * (tile_height + 1) - 1)
+        canvas = Image.new('RGB', size, (0x33, 0x33, 0x33))
+        blank = Image.new('RGB', (tile_width, tile_height))
+        for slot in range(rows * MOSAIC_COLUMNS):
+            frame = frames[slot] if slot < len(frames) else None
+            tile = blank
+            if frame is not None:
+                try:
+                    with Image.open(io.BytesIO(frame.data)) as image:
+                        # JPEG 直接以縮小的比例解碼，比完整解碼後再縮小快得多
+                        image.draft('RGB', (tile_width, tile_height))
+                        tile = image.convert('RGB').resize((tile_width, tile_height), Image.BILINEAR)
+                except Exception:
+                    tile = blank
+            row, column = divmod(slot, MOSAIC_COLUMNS)
+            canvas.paste(tile, (column * (tile_width + 1), row * (tile_height + 1)))
+        output = io.BytesIO()
+        canvas.save(output, 'JPEG', quality=MOSAIC_QUALITY)
+        metrics.inc('cctv_mosaic_requests_total', outcome='composed')
+        metrics.observe('cctv_mosaic_compose_seconds', time.perf_counter() - start)
+        return output.getvalue()
+
+mosaic_builder = MosaicBuilder()
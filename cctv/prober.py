@@ -0,0 +1,167 @@
+"""
+在背景定期檢查攝影機是否可連線，記錄延遲與可用率
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from collections import deque
+import threading
+import time
+from cctv.core import UpstreamUnavailable, metrics
+from cctv.frames import iter_available, read_first_jpeg
+from cctv import core
+
+# 攝影機健康檢查設定
+PROBE_INTERVAL = 60  # 每輪檢查間隔（秒）
+PROBE_WORKERS = 8  # 同時檢查的攝影機數
+PROBE_TIMEOUT = 5  # 單次檢查逾時秒數
+PROBE_HISTORY = 50  # 保留的檢查紀錄筆數
+PROBE_DEAD_AFTER = 3  # 連續失敗幾次視為離線
+
+@dataclass
+class CameraHealth:
+    """單一攝影機的檢查紀錄"""
+    url: str
+    latencies: deque = field(default_factory=lambda: deque(maxlen=PROBE_HISTORY))
+    results: deque = field(default_factory=lambda: deque(maxlen=PROBE_HISTORY))
+    consecutive_failures: int = 0
+    last_good: float = None  # 最後一次成功的時間（epoch 秒）
+    last_checked: float = None
+    last_error: str = None
+    
+    @property
+    def alive(self):
+        # 尚未檢查過的攝影機視為正常
+        return self.consecutive_failures < PROBE_DEAD_AFTER
+    
+    @property
+    def availability(self):
+        if not self.results:
+            return None
+        return sum(self.results) / len(self.results)
+    
+    def percentile(self, pct):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+    
+    def record(self, latency, error):
+        self.last_checked = time.time()
+        self.results.append(error is None)
+        if error is None:
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+            self.last_good = self.last_checked
+            self.last_error = None
+        else:
+            self.consecutive_failures += 1
+            self.last_error = error
+    
+    def to_dict(self):
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+        return {
+            "url": self.url,
+            "alive": self.alive,
+            "availability": self.availability,
+            "p50_ms": ms(self.percentile(50)),
+            "p95_ms": ms(self.percentile(95)),
+            "last_good": self.last_good,
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+        }
+
+def probe_camera(url, timeout=PROBE_TIMEOUT):
+    """以最少的流量檢查攝影機：只要求前 1 KB，MJPEG 串流只讀第一張畫面
+    
+    回傳 (延遲秒數, 錯誤訊息或 None)；主機斷路中表示主機連續失敗，視為檢查失敗。
+    只是等不到權杖或名額時回傳 None，這時無法得知攝影機本身的狀態。檢查屬於背景請求，不會佔用觀看中的請求需要的權杖。
+    """
+    start = time.perf_counter()
+    try:
+        with core.upstream.get(url, headers={'Range': 'bytes=0-1023'}, timeout=timeout, background=True) as response:
+            response.raise_for_status()
+            if response.headers.get('Content-Type', '').startswith('multipart/'):
+                read_first_jpeg(iter_available(response))
+            else:
+                next(response.iter_content(chunk_size=1024), b'')
+        return time.perf_counter() - start, None
+    except UpstreamUnavailable as e:
+        if e.reason == 'timeout':
+            return None
+        return time.perf_counter() - start, str(e)
+    except Exception as e:
+        return time.perf_counter() - start, str(e)
+
+class HealthProber:
+    """在背景定期檢查 cctv_links.json 中的所有攝影機（限制同時檢查數）"""
+    def __init__(self, index, interval=PROBE_INTERVAL, workers=PROBE_WORKERS):
+        self.index = index
+        self.interval = interval
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.health = {}  # 攝影機識別碼 -> CameraHealth
+        self.generation = 0  # 任何攝影機的存活狀態改變時遞增
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"攝影機檢查錯誤: {e}")
+            self.stop_event.wait(self.interval)
+    
+    def run_once(self):
+        """檢查一輪所有攝影機"""
+        cameras = self.index.cameras()
+        with self.lock:
+            # 移除已不在列表中的攝影機
+            for cam_id in list(self.health):
+                if cam_id not in cameras:
+                    del self.health[cam_id]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for cam_id, result in zip(cameras, executor.map(probe_camera, cameras.values())):
+                if result is None:
+                    # 只是等不到名額，請求沒有發出：保留上一次的檢查結果
+                    metrics.inc('cctv_upstream_requests_total', kind='probe', outcome='rejected')
+                    continue
+                self.record(cam_id, cameras[cam_id], *result)
+    
+    def record(self, cam_id, url, latency, error):
+        with self.lock:
+            health = self.health.get(cam_id)
+            if health is None:
+                health = self.health[cam_id] = CameraHealth(url)
+            was_alive = health.alive
+            health.record(latency, error)
+            if health.alive != was_alive:
+                self.generation += 1
+        metrics.inc('cctv_upstream_requests_total', kind='probe', outcome='ok' if error is None else 'error')
+        metrics.observe('cctv_upstream_seconds', latency, kind='probe')
+    
+    def is_alive(self, cam_id):
+        with self.lock:
+            health = self.health.get(cam_id)
+            return health is None or health.alive
+    
+    def status(self, cam_id):
+        """回傳攝影機的檢查紀錄（dict），尚未檢查過則回傳 None"""
+        with self.lock:
+            health = self.health.get(cam_id)
+            return None if health is None else health.to_dict()
+    
+    def report(self):
+        with self.lock:
+            return {cam_id: health.to_dict() for cam_id, health in self.health.items()}
@@ -0,0 +1,508 @@
+"""
+伺服器端的攝影機代理：連結索引、快照快取與取圖排程、MJPEG 轉送，以及共用的攝影機檢查
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import json
+import hashlib
+from collections import OrderedDict
+import os
+import threading
+import time
+from cctv.core import metrics
+from cctv.store import PAGE_SIZE, links_path
+from cctv.frames import (SNAPSHOT_TIMEOUT, MultipartJPEGParser, camera_id, fetch_frame, is_mjpeg_url,
+                         iter_available, read_frame_body, _multipart_boundary)
+from cctv.prober import HealthProber
+from cctv import core
+
+metrics.describe('cctv_link_index_reloads_total', 'counter', '伺服器重新載入 cctv_links.json 的次數')
+metrics.describe('cctv_link_index_reload_seconds', 'histogram', '重新載入 cctv_links.json 的時間')
+metrics.describe('cctv_relay_frames_total', 'counter', 'MJPEG 轉送收到的畫面數')
+
+# 伺服器端快照代理設定
+SNAPSHOT_TTL = 2.0  # 快照快取有效秒數
+FRAME_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 快照快取大小上限
+REFRESH_INITIAL_INTERVAL = 3.0  # 新攝影機的取圖間隔（秒）
+REFRESH_MIN_INTERVAL = 1.0  # 取圖間隔下限
+REFRESH_MAX_INTERVAL = 60.0  # 取圖間隔上限
+REFRESH_BACKOFF = 1.5  # 畫面未變化時間隔放大倍數
+WATCH_TTL = 30  # 多久沒有客戶端觀看就停止排程（秒）
+SCHEDULER_WORKERS = 8  # 排程取圖的同時連線數
+MJPEG_IDLE_TIMEOUT = 15  # 沒有觀看者多久後關閉上游串流（秒）
+
+class LinkIndex:
+    """在記憶體中保存 cctv_links.json 的內容，只有檔案的修改時間或大小改變時才重新載入
+    
+    版本號為檔案內容的雜湊；每頁另有依內容計算的雜湊，作為 ETag 使用。
+    """
+    def __init__(self, path=None):
+        self.path = path or links_path()
+        self.lock = threading.Lock()
+        self.stat_key = None
+        self.version = None
+        self.timestamp = None
+        self.pages = []
+        self.page_versions = []
+        self.by_id = {}
+        self.rendered = {}  # 'manifest' 或頁碼 -> (存活狀態, 已序列化的回應)，每頁只保留最新的一份
+    
+    def _reload(self):
+        try:
+            st = os.stat(self.path)
+            stat_key = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stat_key = None
+        if stat_key == self.stat_key:
+            return
+        self.stat_key = stat_key
+        start = time.perf_counter()
+        metrics.inc('cctv_link_index_reloads_total')
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            raw = b''
+        version = hashlib.sha1(raw).hexdigest()[:16]
+        if version == self.version:
+            return
+        try:
+            data = json.loads(raw) if raw else {}
+        except json.JSONDecodeError:
+            # 寫入中途或格式錯誤時沿用舊資料，下次再試
+            self.stat_key = None
+            return
+        self.version = version
+        self.timestamp = data.get("timestamp")
+        self.pages = [[link for link in page if link] for page in data.get("pages", [])]
+        self.page_versions = [
+            hashlib.sha1('\n'.join(page).encode('utf-8')).hexdigest()[:16] for page in self.pages
+        ]
+        self.by_id = {camera_id(link): link for page in self.pages for link in page}
+        self.rendered = {}
+        metrics.observe('cctv_link_index_reload_seconds', time.perf_counter() - start)
+    
+    def lookup(self, cam_id):
+        with self.lock:
+            self._reload()
+            return self.by_id.get(cam_id)
+    
+    def cameras(self):
+        """回傳 {識別碼: 網址}"""
+        with self.lock:
+            self._reload()
+            return dict(self.by_id)
+    
+    def manifest(self):
+        """回傳 (ETag, JSON 內容)；skip_pages 為所有攝影機都離線的頁面"""
+        with self.lock:
+            self._reload()
+            health_generation = health_prober.generation
+            cached = self.rendered.get('manifest')
+            if cached is None or cached[0] != health_generation:
+                skip_pages = [
+                    index for index, page in enumerate(self.pages)
+                    if page and not any(health_prober.is_alive(camera_id(link)) for link in page)
+                ]
+                cached = self.rendered['manifest'] = (health_generation, (
+                    f'"m-{self.version}-{health_generation}"', json.dumps({
+                        "version": self.version,
+                        "timestamp": self.timestamp,
+                        "page_count": len(self.pages),
+                        "page_size": PAGE_SIZE,
+                        "skip_pages": skip_pages,
+                    }).encode('utf-8')))
+            return cached[1]
+    
+    def current_version(self):
+        with self.lock:
+            self._reload()
+            return self.version
+    
+    def page_health(self):
+        """回傳每頁的存活狀態字串（每台攝影機一個 '1' 或 '0'）"""
+        with self.lock:
+            self._reload()
+            return [''.join('1' if health_prober.is_alive(camera_id(link)) else '0' for link in page)
+                    for page in self.pages]
+    
+    def page_links(self, index):
+        """回傳 (頁面版本, 連結列表)，頁碼超出範圍時回傳 None"""
+        with self.lock:
+            self._reload()
+            if not 0 <= index < len(self.pages):
+                return None
+            return self.page_versions[index], list(self.pages[index])
+    
+    def page(self, index):
+        """回傳 (ETag, JSON 內容)，頁碼超出範圍時回傳 None
+        
+        離線的攝影機排在頁面最後並標記 alive: false。
+        """
+        with self.lock:
+            self._reload()
+            if not 0 <= index < len(self.pages):
+                return None
+            links = [
+                {"url": link, "id": camera_id(link), "stream": is_mjpeg_url(link)}
+                for link in self.pages[index]
+            ]
+            for link in links:
+                link["alive"] = health_prober.is_alive(link["id"])
+            health_key = ''.join('1' if link["alive"] else '0' for link in links)
+            cached = self.rendered.get(index)
+            if cached is None or cached[0] != health_key:
+                links.sort(key=lambda link: not link["alive"])
+                cached = self.rendered[index] = (health_key, (
+                    f'"p-{self.page_versions[index]}-{health_key}"', json.dumps({
+                        "page": index,
+                        "version": self.page_versions[index],
+                        "links": links,
+                    }, ensure_ascii=False).encode('utf-8')))
+            return cached[1]
+
+@dataclass
+class Frame:
+    """一張快取的畫面"""
+    data: bytes
+    content_type: str
+    fetched_at: float
+    generation: int = 0  # 只有畫面內容改變時才遞增
+    digest: bytes = b''
+
+class FrameCache:
+    """記憶體中的畫面快取，依位元組上限淘汰最久未使用的畫面"""
+    def __init__(self, max_bytes=FRAME_CACHE_MAX_BYTES, ttl=SNAPSHOT_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.frames = OrderedDict()
+        self.total_bytes = 0
+        self.listeners = []  # 畫面內容改變時呼叫 listener(key, frame)
+    
+    def get(self, key, max_age=None):
+        """取得未過期的畫面，沒有則回傳 None"""
+        max_age = self.ttl if max_age is None else max_age
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is None or time.monotonic() - frame.fetched_at > max_age:
+                return None
+            self.frames.move_to_end(key)
+            return frame
+    
+    def peek(self, key):
+        """取得畫面（不論是否過期）"""
+        with self.lock:
+            return self.frames.get(key)
+    
+    def put(self, key, data, content_type):
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        with self.lock:
+            old = self.frames.pop(key, None)
+            if old is not None:
+                self.total_bytes -= len(old.data)
+            generation = 1
+            if old is not None:
+                generation = old.generation if old.digest == digest else old.generation + 1
+            frame = Frame(data, content_type, time.monotonic(), generation, digest)
+            self.frames[key] = frame
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes and len(self.frames) > 1:
+                _, evicted = self.frames.popitem(last=False)
+                self.total_bytes -= len(evicted.data)
+        if old is None or old.generation != frame.generation:
+            for listener in self.listeners:
+                listener(key, frame)
+        return frame
+
+class SingleFlight:
+    """同一個 key 同時只執行一次，其他呼叫者等待並共用結果"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+    
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+        
+        if not leader:
+            call['done'].wait()
+        else:
+            try:
+                call['result'] = fn()
+            except Exception as e:
+                call['error'] = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call['done'].set()
+        
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+
+link_index = LinkIndex()
+frame_cache = FrameCache()
+snapshot_flight = SingleFlight()
+
+@dataclass
+class RefreshState:
+    """單一攝影機的更新排程"""
+    url: str
+    interval: float = REFRESH_INITIAL_INTERVAL  # 目前的取圖間隔
+    change_interval: float = None  # 觀察到的畫面更新間隔（指數移動平均）
+    last_change: float = None
+    generation: int = 0
+    next_fetch: float = 0.0
+    watched_until: float = 0.0
+    fetching: bool = False
+
+class FrameScheduler:
+    """依各攝影機實際的畫面更新頻率安排取圖
+    
+    畫面有變化時縮短間隔（約為更新間隔的一半），沒有變化時逐步拉長；
+    只有最近有客戶端觀看的攝影機才會排程。
+    """
+    def __init__(self, cache, workers=SCHEDULER_WORKERS):
+        self.cache = cache
+        self.workers = workers
+        self.cond = threading.Condition()
+        self.states = {}  # 攝影機識別碼 -> RefreshState
+        self.executor = None
+        self.thread = None
+    
+    def watch(self, cam_id, url):
+        """標記攝影機正在被觀看，必要時開始排程"""
+        now = time.monotonic()
+        with self.cond:
+            state = self.states.get(cam_id)
+            if state is None or state.url != url:
+                # 已有較新的畫面（例如剛預熱過）時不必立即再取一次
+                frame = self.cache.peek(cam_id)
+                next_fetch = now
+                if frame is not None:
+                    next_fetch = max(now, frame.fetched_at + REFRESH_INITIAL_INTERVAL)
+                state = self.states[cam_id] = RefreshState(url, next_fetch=next_fetch)
+            state.watched_until = now + WATCH_TTL
+            if self.thread is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='refresh')
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+    
+    def max_age(self, cam_id):
+        """排程中的攝影機由排程負責更新，可接受較舊的快取"""
+        with self.cond:
+            state = self.states.get(cam_id)
+            if state is None:
+                return SNAPSHOT_TTL
+            return max(SNAPSHOT_TTL, state.interval * 2)
+    
+    def _run(self):
+        while True:
+            with self.cond:
+                now = time.monotonic()
+                wait = 1.0
+                for cam_id, state in list(self.states.items()):
+                    if state.watched_until < now:
+                        del self.states[cam_id]
+                    elif not state.fetching and state.next_fetch <= now:
+                        state.fetching = True
+                        self.executor.submit(self._fetch, cam_id, state)
+                    elif not state.fetching:
+                        wait = min(wait, state.next_fetch - now)
+                self.cond.wait(max(wait, 0.05))
+    
+    def _fetch(self, cam_id, state):
+        error = False
+        relay = mjpeg_relays.get(cam_id)
+        try:
+            if relay is None or not relay.alive:
+                # 串流轉送執行中時畫面已由轉送更新，不必另外取圖
+                def load():
+                    # 與 get_snapshot 共用同一個 key，回傳值必須同樣是 Frame
+                    data, content_type = fetch_frame(state.url)
+                    return self.cache.put(cam_id, data, content_type)
+                snapshot_flight.do(cam_id, load)
+        except Exception:
+            error = True
+        frame = self.cache.peek(cam_id)
+        with self.cond:
+            now = time.monotonic()
+            if error:
+                state.interval = min(state.interval * 2, REFRESH_MAX_INTERVAL)
+            elif frame is not None and frame.generation != state.generation:
+                # 畫面有變化：以觀察到的更新間隔調整取圖頻率
+                state.generation = frame.generation
+                if state.last_change is not None:
+                    observed = now - state.last_change
+                    if state.change_interval is None:
+                        state.change_interval = observed
+                    else:
+                        state.change_interval = 0.7 * state.change_interval + 0.3 * observed
+                state.last_change = now
+                target = (state.change_interval or REFRESH_INITIAL_INTERVAL) / 2
+                state.interval = min(max(target, REFRESH_MIN_INTERVAL), REFRESH_MAX_INTERVAL)
+            else:
+                # 畫面沒有變化：逐步拉長間隔，但不超過觀察到的更新間隔
+                limit = REFRESH_MAX_INTERVAL
+                if state.change_interval is not None:
+                    limit = min(limit, max(state.change_interval, REFRESH_MIN_INTERVAL))
+                state.interval = min(state.interval * REFRESH_BACKOFF, limit)
+            state.next_fetch = now + state.interval
+            state.fetching = False
+            self.cond.notify()
+    
+    def generations(self, cam_ids):
+        """回傳 {識別碼: 畫面世代}，尚無畫面時為 0"""
+        result = {}
+        for cam_id in cam_ids:
+            frame = self.cache.peek(cam_id)
+            result[cam_id] = frame.generation if frame is not None else 0
+        return result
+
+frame_scheduler = FrameScheduler(frame_cache)
+
+def load_frame(cam_id, url, max_age=None, background=False):
+    """取得未過期的快取畫面，沒有則向上游取圖；同一台攝影機的同時請求只會向上游取一次"""
+    frame = frame_cache.get(cam_id, max_age)
+    if frame is not None:
+        return frame
+    
+    def load():
+        # 等待期間可能已由其他請求更新
+        cached = frame_cache.get(cam_id, max_age)
+        if cached is not None:
+            return cached
+        data, content_type = fetch_frame(url, background=background)
+        return frame_cache.put(cam_id, data, content_type)
+    
+    return snapshot_flight.do(cam_id, load)
+
+def get_snapshot(cam_id):
+    """取得攝影機的最新快照，並讓排程持續更新這台攝影機"""
+    url = link_index.lookup(cam_id)
+    if url is None:
+        return None
+    frame_scheduler.watch(cam_id, url)
+    return load_frame(cam_id, url, frame_scheduler.max_age(cam_id))
+
+class MJPEGRelay:
+    """每台攝影機只維持一條上游連線，將最新畫面轉送給所有觀看者
+    
+    觀看者只會取得最新的畫面，來不及送出的中間畫面直接丟棄，
+    因此慢速客戶端不會讓記憶體無限增長。
+    """
+    def __init__(self, cam_id, url):
+        self.cam_id = cam_id
+        self.url = url
+        self.cond = threading.Condition()
+        self.frame = None
+        self.generation = 0
+        self.clients = 0
+        self.last_client = time.monotonic()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    @property
+    def alive(self):
+        return self.thread.is_alive() and not self.stopped
+    
+    def attach(self):
+        with self.cond:
+            self.clients += 1
+    
+    def detach(self):
+        with self.cond:
+            self.clients -= 1
+            self.last_client = time.monotonic()
+    
+    def _idle(self):
+        with self.cond:
+            return self.clients == 0 and time.monotonic() - self.last_client > MJPEG_IDLE_TIMEOUT
+    
+    def _publish(self, data):
+        metrics.inc('cctv_relay_frames_total')
+        frame_cache.put(self.cam_id, data, 'image/jpeg')
+        with self.cond:
+            self.frame = data
+            self.generation += 1
+            self.cond.notify_all()
+    
+    def wait_frame(self, last_generation, timeout):
+        """等待比 last_generation 更新的畫面，回傳 (generation, 畫面) 或 None"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.generation > last_generation or self.stopped, timeout)
+            if self.generation > last_generation:
+                return self.generation, self.frame
+            return None
+    
+    def _run(self):
+        backoff = 1
+        try:
+            while not self._idle():
+                try:
+                    self._relay_once()
+                    backoff = 1
+                except Exception as e:
+                    print(f"MJPEG 轉送錯誤 {self.url}: {e}")
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+        finally:
+            with self.cond:
+                self.stopped = True
+                self.cond.notify_all()
+    
+    def _relay_once(self):
+        with core.upstream.get(self.url, timeout=(SNAPSHOT_TIMEOUT, SNAPSHOT_TIMEOUT), long_lived=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            if not content_type.startswith('multipart/'):
+                # 上游不是串流時改為定期取圖
+                self._publish(read_frame_body(response))
+                time.sleep(SNAPSHOT_TTL)
+                return
+            
+            parser = MultipartJPEGParser(_multipart_boundary(content_type))
+            for chunk in iter_available(response):
+                for data in parser.feed(chunk):
+                    self._publish(data)
+                if self._idle():
+                    return
+
+mjpeg_relays = {}  # 攝影機識別碼 -> MJPEGRelay
+mjpeg_relays_lock = threading.Lock()
+
+def get_relay(cam_id):
+    """取得（必要時啟動）攝影機的 MJPEG 轉送"""
+    url = link_index.lookup(cam_id)
+    if url is None:
+        return None
+    with mjpeg_relays_lock:
+        relay = mjpeg_relays.get(cam_id)
+        if relay is None or not relay.alive:
+            relay = MJPEGRelay(cam_id, url)
+            relay.start()
+            mjpeg_relays[cam_id] = relay
+        relay.attach()
+        return relay
+
+health_prober = HealthProber(link_index)
+
+def _camera_states():
+    report = health_prober.report()
+    alive = sum(1 for health in report.values() if health["alive"])
+    return {(('state', 'alive'),): alive, (('state', 'dead'),): len(report) - alive}
+
+metrics.gauge('cctv_frame_cache_bytes', '快照快取使用的位元組數', lambda: frame_cache.total_bytes)
+metrics.gauge('cctv_relays_active', '執行中的 MJPEG 轉送數', lambda: sum(relay.alive for relay in list(mjpeg_relays.values())))
+metrics.gauge('cctv_relay_viewers', 'MJPEG 轉送的觀看者數', lambda: sum(relay.clients for relay in list(mjpeg_relays.values())))
+metrics.gauge('cctv_scheduled_cameras', '排程取圖中的攝影機數', lambda: len(frame_scheduler.states))
+metrics.gauge('cctv_cameras', '依檢查結果分類的攝影機數', _camera_states)
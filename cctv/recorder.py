@@ -0,0 +1,305 @@
+"""
+將最近的畫面保存在每台攝影機一個的環狀錄影檔中，供回放與縮時串流使用
+"""
+
+import re
+import mmap
+import struct
+from collections import OrderedDict
+import os
+import threading
+import time
+from cctv.core import CACHE_DIR_NAME, atomic_write, get_app_dir, metrics
+from cctv.proxy import WATCH_TTL
+from cctv import proxy
+
+# 錄影設定
+RECORD_ENABLED = True  # 是否將出現過的畫面保存在錄影檔中供回放
+RECORD_ALL_CAMERAS = False  # 是否在背景持續取得 cctv_links.json 中所有攝影機的畫面（否則只錄製有人觀看的攝影機）
+RECORD_DIR_NAME = 'recordings'  # 錄影檔目錄（位於來源頁面快取目錄下）
+RECORD_FILE_BYTES = 8 * 1024 * 1024  # 每台攝影機的錄影檔大小（固定，寫滿後覆蓋最舊的畫面）
+RECORD_SLOTS = 1024  # 每台攝影機最多保留的畫面數
+RECORD_MIN_INTERVAL = 2.0  # 同一台攝影機兩張錄影畫面的最短間隔（秒）
+RECORD_RETENTION = 600  # 只回放最近幾秒內的畫面
+RECORD_MAX_OPEN = 64  # 同時映射到記憶體的錄影檔數，超過時關閉最久未用的檔案
+RECORD_MAX_BYTES = 1024 * 1024 * 1024  # 所有錄影檔的總大小上限，超過時刪除最久沒有寫入的錄影檔
+RECORD_PRUNE_INTERVAL = 300  # 多久檢查一次並刪除已不在 cctv_links.json 中的攝影機的錄影檔（秒）
+TIMELAPSE_FPS = 10  # 縮時串流預設每秒張數
+TIMELAPSE_MAX_FPS = 30  # 縮時串流每秒張數上限
+
+# 錄影檔格式：標頭、固定格數的索引、資料區
+RING_MAGIC = b'CCTVRNG1'
+RING_HEADER = struct.Struct('<8sIIQQQ')  # 標記、索引格數、保留、資料區大小、已寫入畫面數、下次寫入位置
+RING_ENTRY = struct.Struct('<QdQII')  # 畫面序號、時間（epoch 秒）、資料位置、長度（0 表示已失效）、保留
+RING_INDEX_OFFSET = 64
+
+metrics.describe('cctv_recorder_frames_total', 'counter', '寫入錄影檔的畫面數')
+
+def image_content_type(data):
+    """依檔頭判斷圖片格式"""
+    if data.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data.startswith(b'GIF8'):
+        return 'image/gif'
+    return 'application/octet-stream'
+
+class FrameRing:
+    """單一攝影機的環狀錄影檔（以 mmap 存取，大小固定）
+    
+    新畫面接在上一張之後寫入，寫到資料區尾端時從頭開始；被覆蓋的舊畫面會先從索引中移除，
+    因此索引中的畫面一定是完整的。索引依畫面序號存放，時間依序遞增。
+    """
+    def __init__(self, path, size=RECORD_FILE_BYTES, slots=RECORD_SLOTS):
+        self.path = path
+        self.slots = slots
+        self.data_offset = RING_INDEX_OFFSET + slots * RING_ENTRY.size
+        self.data_size = size - self.data_offset
+        if self.data_size <= 0:
+            raise ValueError("錄影檔太小")
+        self.lock = threading.Lock()
+        self.closed = False
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            # 新檔案或大小改變：在暫存檔建立空白的錄影檔再取代，中途被中斷也不會留下大小不對的檔案
+            with atomic_write(path, 'wb') as f:
+                f.write(RING_HEADER.pack(RING_MAGIC, slots, 0, self.data_size, 0, 0))
+                f.truncate(size)
+        with open(path, 'r+b') as f:
+            self.map = mmap.mmap(f.fileno(), size)
+        magic, file_slots, _, data_size, self.seq, self.write_pos = RING_HEADER.unpack_from(self.map, 0)
+        if magic != RING_MAGIC or file_slots != slots or data_size != self.data_size:
+            # 新檔案或設定改變：清空索引重新開始
+            self.map[:self.data_offset] = bytes(self.data_offset)
+            self.seq = self.write_pos = 0
+            self._write_header()
+        self.first = max(0, self.seq - slots)  # 最舊的可能有效畫面序號
+    
+    def _write_header(self):
+        RING_HEADER.pack_into(self.map, 0, RING_MAGIC, self.slots, 0, self.data_size, self.seq, self.write_pos)
+    
+    def _entry_offset(self, seq):
+        return RING_INDEX_OFFSET + (seq % self.slots) * RING_ENTRY.size
+    
+    def _entry(self, seq):
+        # 回傳 (時間, 位置, 長度)，畫面已被覆蓋時回傳 None
+        if not max(self.first, self.seq - self.slots) <= seq < self.seq:
+            return None
+        stored_seq, timestamp, offset, length, _ = RING_ENTRY.unpack_from(self.map, self._entry_offset(seq))
+        if stored_seq != seq or length == 0:
+            return None
+        return timestamp, offset, length
+    
+    def _drop_overlapping(self, start, end):
+        # 由最舊的畫面開始移除與 [start, end) 重疊的畫面；寫入位置之後的畫面依序較新，遇到不重疊的即可停止
+        self.first = max(self.first, self.seq - self.slots)
+        while self.first < self.seq:
+            entry = self._entry(self.first)
+            if entry is not None:
+                _, offset, length = entry
+                if offset >= end or offset + length <= start:
+                    break
+                RING_ENTRY.pack_into(self.map, self._entry_offset(self.first), self.first, 0.0, 0, 0, 0)
+            self.first += 1
+    
+    def append(self, timestamp, data):
+        """寫入一張畫面，畫面大於資料區時回傳 False"""
+        length = len(data)
+        with self.lock:
+            if self.closed or not 0 < length <= self.data_size:
+                return False
+            if self.write_pos + length > self.data_size:
+                # 尾端放不下，剩餘的空間連同其中的舊畫面一起捨棄
+                self._drop_overlapping(self.write_pos, self.data_size)
+                self.write_pos = 0
+            self._drop_overlapping(self.write_pos, self.write_pos + length)
+            start = self.data_offset + self.write_pos
+            self.map[start:start + length] = data
+            # 先寫入畫面與索引，最後才更新標頭，中途中斷時不會出現指向不完整資料的索引
+            RING_ENTRY.pack_into(self.map, self._entry_offset(self.seq), self.seq, timestamp, self.write_pos, length, 0)
+            self.seq += 1
+            self.write_pos += length
+            self._write_header()
+            return True
+    
+    def times(self, start=None, end=None):
+        """回傳時間在 [start, end] 內的 [(時間, 序號)]，依時間排序"""
+        with self.lock:
+            if self.closed:
+                return []
+            result = []
+            for seq in range(max(self.first, self.seq - self.slots), self.seq):
+                entry = self._entry(seq)
+                if entry is None:
+                    continue
+                if (start is None or entry[0] >= start) and (end is None or entry[0] <= end):
+                    result.append((entry[0], seq))
+            return result
+    
+    def read(self, seq):
+        """回傳 (時間, 內容)，畫面已被覆蓋時回傳 None"""
+        with self.lock:
+            entry = None if self.closed else self._entry(seq)
+            if entry is None:
+                return None
+            timestamp, offset, length = entry
+            start = self.data_offset + offset
+            return timestamp, bytes(self.map[start:start + length])
+    
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.map.close()
+
+class FrameRecorder:
+    """把快照快取中出現的新畫面寫入各攝影機的環狀錄影檔，並提供回放
+    
+    每台攝影機的錄影檔大小固定，同時映射到記憶體的檔案數有上限；錄影檔總數以 max_bytes 限制，
+    建立新的錄影檔時會刪除最久沒有寫入的檔案。已從 cctv_links.json 移除的攝影機的錄影檔會定期刪除。
+    """
+    def __init__(self, directory=None, max_open=RECORD_MAX_OPEN, min_interval=RECORD_MIN_INTERVAL,
+                 retention=RECORD_RETENTION, follow_all=RECORD_ALL_CAMERAS, max_bytes=RECORD_MAX_BYTES):
+        self.directory = directory or os.path.join(get_app_dir(), CACHE_DIR_NAME, RECORD_DIR_NAME)
+        self.max_open = max_open
+        self.max_files = max(1, max_bytes // RECORD_FILE_BYTES)
+        self.min_interval = min_interval
+        self.retention = retention
+        self.follow_all = follow_all
+        self.lock = threading.Lock()
+        self.rings = OrderedDict()  # 攝影機識別碼 -> FrameRing，依使用時間排序
+        self.last_recorded = {}  # 攝影機識別碼 -> 最後錄製時間（monotonic）
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def _ring(self, cam_id, create=False):
+        if not re.fullmatch(r'[0-9a-f]{1,64}', cam_id):
+            return None
+        path = os.path.join(self.directory, f'{cam_id}.ring')
+        with self.lock:
+            ring = self.rings.get(cam_id)
+            if ring is not None:
+                self.rings.move_to_end(cam_id)
+                return ring
+            if not os.path.exists(path):
+                if not create:
+                    return None
+                os.makedirs(self.directory, exist_ok=True)
+                # 為新的錄影檔騰出空間
+                files = self._ring_files()
+                for name in sorted(files, key=files.get)[:max(0, len(files) - self.max_files + 1)]:
+                    self._delete(name)
+            ring = self.rings[cam_id] = FrameRing(path)
+            while len(self.rings) > self.max_open:
+                _, evicted = self.rings.popitem(last=False)
+                evicted.close()
+            return ring
+    
+    def _ring_files(self):
+        # 回傳 {攝影機識別碼: 最後修改時間}
+        files = {}
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return files
+        for entry in entries:
+            if entry.name.endswith('.ring'):
+                try:
+                    files[entry.name[:-len('.ring')]] = entry.stat().st_mtime
+                except OSError:
+                    pass
+        return files
+    
+    def _delete(self, cam_id):
+        # 須持有 self.lock；先解除記憶體映射再刪除檔案
+        ring = self.rings.pop(cam_id, None)
+        if ring is not None:
+            ring.close()
+        self.last_recorded.pop(cam_id, None)
+        try:
+            os.remove(os.path.join(self.directory, f'{cam_id}.ring'))
+        except OSError:
+            pass
+    
+    def prune(self, cameras=None):
+        """刪除不在 cameras（預設為 cctv_links.json 中的攝影機）的錄影檔，回傳刪除的檔案數
+        
+        攝影機列表是空的（檔案不存在或讀取失敗）時不刪除，避免誤刪所有錄影。
+        """
+        if cameras is None:
+            cameras = proxy.link_index.cameras()
+        if not cameras:
+            return 0
+        with self.lock:
+            removed = [cam_id for cam_id in self._ring_files() if cam_id not in cameras]
+            for cam_id in removed:
+                self._delete(cam_id)
+            return len(removed)
+    
+    def record(self, cam_id, frame):
+        """FrameCache 的畫面監聽器：同一台攝影機每 min_interval 秒最多錄製一張"""
+        now = time.monotonic()
+        with self.lock:
+            last = self.last_recorded.get(cam_id)
+            if last is not None and now - last < self.min_interval:
+                return
+            self.last_recorded[cam_id] = now
+        try:
+            ring = self._ring(cam_id, create=True)
+            if ring is not None and ring.append(time.time(), frame.data):
+                metrics.inc('cctv_recorder_frames_total')
+        except (OSError, ValueError) as e:
+            print(f"錄影錯誤 {cam_id}: {e}")
+    
+    def frames(self, cam_id, start=None, end=None):
+        """回傳保留期限內、時間在 [start, end] 的 [(時間, 序號)]"""
+        ring = self._ring(cam_id)
+        if ring is None:
+            return []
+        oldest = time.time() - self.retention
+        return ring.times(oldest if start is None else max(start, oldest), end)
+    
+    def read(self, cam_id, seq):
+        ring = self._ring(cam_id)
+        return None if ring is None else ring.read(seq)
+    
+    def frame_at(self, cam_id, timestamp):
+        """回傳不晚於 timestamp 的最後一張畫面 (時間, 內容)；都比 timestamp 晚時回傳最早的一張"""
+        times = self.frames(cam_id)
+        before = [item for item in times if item[0] <= timestamp]
+        # 讀取前畫面可能剛被覆蓋，依序改用較早（或較晚）的畫面
+        for _, seq in reversed(before) if before else times:
+            result = self.read(cam_id, seq)
+            if result is not None:
+                return result
+        return None
+    
+    def start(self):
+        """在背景定期刪除已移除攝影機的錄影檔；follow_all 時另外持續排程所有攝影機，讓沒有人觀看的攝影機也被錄製"""
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def _run(self):
+        last_prune = None
+        while not self.stop_event.is_set():
+            if self.follow_all:
+                for cam_id, url in proxy.link_index.cameras().items():
+                    if proxy.health_prober.is_alive(cam_id):
+                        proxy.frame_scheduler.watch(cam_id, url)
+            if last_prune is None or time.monotonic() - last_prune >= RECORD_PRUNE_INTERVAL:
+                last_prune = time.monotonic()
+                try:
+                    self.prune()
+                except Exception as e:
+                    print(f"清理錄影檔錯誤: {e}")
+            self.stop_event.wait(WATCH_TTL / 2)
+
+frame_recorder = FrameRecorder()
+if RECORD_ENABLED:
+    proxy.frame_cache.listeners.append(frame_recorder.record)
+metrics.gauge('cctv_recorder_open_files', '映射到記憶體的錄影檔數', lambda: len(frame_recorder.rings))
@@ -0,0 +1,723 @@
+"""
+本地 HTTP 伺服器：執行緒池、路由與共用的伺服器實例
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import re
+import socket
+import selectors
+import queue
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+import os
+import threading
+import http.server
+import time
+from cctv.core import CACHE_DIR_NAME, get_app_dir, metrics
+from cctv.store import LINKS_FILE
+from cctv.proxy import get_relay, get_snapshot
+from cctv.recorder import TIMELAPSE_FPS, TIMELAPSE_MAX_FPS, image_content_type
+from cctv.events import EVENT_KEEPALIVE, EVENT_RETRY_MS, format_event
+from cctv.warmup import WARMUP_MAX_BODY
+from cctv.mosaic import MOSAIC_MAX_WIDTH, MOSAIC_MIN_WIDTH, MOSAIC_TILE_WIDTH, MOSAIC_WIDTH_STEP
+from cctv import core, proxy, recorder, events, warmup, mosaic
+
+# 伺服器設定
+PORT = 8000  # 伺服器埠號（實際綁定的埠號由 ServerManager 更新）
+SERVER_PORTS = range(8000, 8010)  # 依序嘗試的埠號
+MAX_FRAME_IDS = 64  # /api/frames 單次查詢的攝影機數上限
+
+metrics.describe('cctv_http_requests_total', 'counter', '本地伺服器處理的請求數')
+metrics.describe('cctv_http_request_seconds', 'histogram', '本地伺服器處理請求的時間（串流為連線時間）')
+metrics.describe('cctv_http_response_bytes_total', 'counter', '本地伺服器送出的位元組數')
+metrics.describe('cctv_http_streams_rejected_total', 'counter', '長時間連線已滿而回應 503 的請求數')
+
+# 連線與串流設定
+MJPEG_CLIENT_TIMEOUT = 10  # 客戶端寫入逾時，超過即視為斷線（秒）
+MJPEG_BOUNDARY = b'cctvframe'  # 轉送給客戶端時使用的分隔字串
+SERVER_WORKERS = 64  # 同時處理請求的執行緒上限
+STREAM_MAX_CONNECTIONS = 256  # 同時進行的長時間連線（MJPEG、推播、縮時）上限，各佔一條專用執行緒，不佔用執行緒池
+STREAM_RETRY_AFTER = 10  # 長時間連線已滿時要求客戶端等待的秒數
+KEEPALIVE_TIMEOUT = 15  # 閒置的 keep-alive 連線保留秒數
+REQUEST_TIMEOUT = 15  # 讀取單一請求的逾時秒數
+
+# 有固定名稱的路徑；其他路徑在指標中歸為 static 或以前綴表示，避免指標數量隨攝影機數增加
+METRIC_ROUTES = {'/', '/index.html', '/' + LINKS_FILE, '/api/manifest', '/api/frames', '/api/health', '/api/warmup',
+                 '/api/upstream', '/metrics', '/events'}
+METRIC_ROUTE_PREFIXES = ('/snapshot/', '/stream/', '/mosaic/', '/replay/', '/timelapse/', '/api/pages/',
+                         '/api/recordings/')
+
+def route_label(path):
+    """將請求路徑轉為指標使用的路由名稱"""
+    path = urlsplit(path).path
+    if path in METRIC_ROUTES:
+        return path
+    for prefix in METRIC_ROUTE_PREFIXES:
+        if path.startswith(prefix):
+            return prefix + '*'
+    return 'static'
+
+class _CountingWriter:
+    """計算寫出位元組數的 wfile 包裝；HEAD 請求送出標頭後丟棄內容"""
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes = 0
+        self.discard = False  # 丟棄之後寫入的內容
+        self.abort = False  # 丟棄時改為拋出 ConnectionAbortedError，讓串流的迴圈結束
+    
+    def write(self, data):
+        if self.discard:
+            if self.abort:
+                raise ConnectionAbortedError("HEAD 請求不送出內容")
+            return len(data)
+        self.bytes += len(data)
+        return self.raw.write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+class CustomHandler(http.server.SimpleHTTPRequestHandler):
+    # 支援 keep-alive；在 PooledHTTPServer 中閒置的連線不佔用執行緒
+    protocol_version = 'HTTP/1.1'
+    timeout = REQUEST_TIMEOUT
+    # 標頭與內容分開寫入，關閉 Nagle 以免 keep-alive 連線被延遲 ACK 拖慢
+    disable_nagle_algorithm = True
+    
+    def __init__(self, *args, directory=None, **kwargs):
+        # 根目錄固定為程式所在目錄，不再切換行程的工作目錄
+        super().__init__(*args, directory=directory or get_app_dir(), **kwargs)
+    
+    def setup(self):
+        super().setup()
+        self.wfile = _CountingWriter(self.wfile)
+        self.detached = None  # 交由專用執行緒處理的 (方法, 參數)
+    
+    def finish(self):
+        # 交由專用執行緒處理的連線在 run_detached 結束時才關閉
+        if self.detached is None:
+            super().finish()
+    
+    def handle_one_request(self):
+        # 記錄每個請求的路由、狀態碼、處理時間與回應大小
+        self.status_code = None
+        self.wfile.bytes = 0
+        self.wfile.discard = self.wfile.abort = False
+        start = time.perf_counter()
+        try:
+            super().handle_one_request()
+        finally:
+            self._record_request(start)
+    
+    def _record_request(self, start):
+        if self.status_code is not None:
+            # 請求列無法解析時 path 可能尚未設定
+            route = route_label(getattr(self, 'path', ''))
+            metrics.inc('cctv_http_requests_total', route=route, status=str(self.status_code))
+            metrics.observe('cctv_http_request_seconds', time.perf_counter() - start, route=route)
+            metrics.inc('cctv_http_response_bytes_total', self.wfile.bytes, route=route)
+    
+    def detach(self, method, *args):
+        """長時間的回應（串流、推播）改由專用執行緒處理，工作執行緒立即回到執行緒池
+        
+        同時進行的長時間連線已達上限時回應 503；不是 PooledHTTPServer 時直接在目前的執行緒處理。
+        """
+        if self.command == 'HEAD':
+            # HEAD 只需要標頭：第一次寫入內容時就結束，不佔用長時間連線的名額
+            self.wfile.abort = True
+            return method(*args)
+        slots = getattr(self.server, 'stream_slots', None)
+        if slots is None:
+            return method(*args)
+        if not slots.acquire(blocking=False):
+            metrics.inc('cctv_http_streams_rejected_total')
+            self.send_response(503)
+            self.send_header('Retry-After', str(STREAM_RETRY_AFTER))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.close_connection = True
+        self.detached = (method, args)
+    
+    def run_detached(self):
+        """由伺服器在專用執行緒中呼叫，處理完畢後關閉連線"""
+        method, args = self.detached
+        self.status_code = None
+        self.wfile.bytes = 0
+        start = time.perf_counter()
+        try:
+            method(*args)
+        finally:
+            self._record_request(start)
+            try:
+                super().finish()
+            except OSError:
+                pass
+    
+    def send_response_only(self, code, message=None):
+        self.status_code = code
+        super().send_response_only(code, message)
+    
+    def end_headers(self):
+        super().end_headers()
+        if self.command == 'HEAD':
+            self.wfile.discard = True
+    
+    def handle(self):
+        if not hasattr(self.server, 'park'):
+            return super().handle()
+        # 每次只處理已到達的請求，之後把連線交回伺服器等待下一個請求
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self._has_buffered_input():
+            self.handle_one_request()
+        self.keep_alive = not self.close_connection
+    
+    def _has_buffered_input(self):
+        # 管線化的請求可能已讀入緩衝區，必須由同一個處理器處理
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+    
+    def client_gone(self):
+        """長時間連線的客戶端是否已關閉連線（只檢查不讀取，等待新資料的空檔呼叫）"""
+        self.connection.setblocking(False)
+        try:
+            return self.connection.recv(1, socket.MSG_PEEK) == b''
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        finally:
+            self.connection.settimeout(MJPEG_CLIENT_TIMEOUT)
+    
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        
+        # 快照代理
+        if path.startswith('/snapshot/'):
+            return self.send_snapshot(path[len('/snapshot/'):])
+        if path.startswith('/stream/'):
+            return self.detach(self.send_stream, path[len('/stream/'):])
+        if path.startswith('/mosaic/'):
+            return self.send_mosaic(path[len('/mosaic/'):])
+        if path.startswith('/replay/'):
+            return self.send_replay(path[len('/replay/'):])
+        if path.startswith('/timelapse/'):
+            return self.detach(self.send_timelapse, path[len('/timelapse/'):])
+        if path.startswith('/api/recordings/'):
+            return self.send_recording_index(path[len('/api/recordings/'):])
+        if path == '/api/manifest':
+            return self.send_cached_json(proxy.link_index.manifest())
+        if path.startswith('/api/pages/'):
+            try:
+                index = int(path[len('/api/pages/'):])
+            except ValueError:
+                index = -1
+            return self.send_cached_json(proxy.link_index.page(index))
+        if path == '/api/frames':
+            return self.send_frames()
+        if path == '/api/health':
+            return self.send_json(proxy.health_prober.report())
+        if path == '/api/upstream':
+            return self.send_json(core.upstream.report())
+        if path == '/metrics':
+            return self.send_metrics()
+        if path == '/events':
+            return self.detach(self.send_events)
+        
+        # 如果請求根路徑，自動導向到 index.html
+        if self.path == '/':
+            self.path = '/index.html'
+        if self.is_private_path():
+            self.send_error(404, "Not Found", "找不到頁面")
+            return
+        if self.command == 'HEAD':
+            return super().do_HEAD()
+        return super().do_GET()
+    
+    def is_private_path(self):
+        """連結資料庫、快取目錄與暫存檔不提供下載（以實際的檔案路徑判斷，編碼或 ../ 都無法繞過）"""
+        relative = os.path.relpath(self.translate_path(self.path), self.directory)
+        parts = [part.lower() for part in relative.split(os.sep)]
+        if CACHE_DIR_NAME in parts:
+            return True
+        name = parts[-1]
+        return name.endswith('.tmp') or re.search(r'\.db($|-)', name) is not None
+    
+    def do_HEAD(self):
+        # 與 GET 相同的路由，送出標頭後丟棄內容（見 end_headers）
+        return self.do_GET()
+    
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path == '/api/warmup':
+            return self.handle_warmup()
+        self.send_error(404, "Not Found", "找不到頁面")
+    
+    def read_json_body(self, max_bytes):
+        """讀取 JSON 請求內容，格式錯誤或過大時回傳 None"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if not 0 <= length <= max_bytes:
+            # 未讀取的內容會留在連線中，不能再處理下一個請求
+            self.close_connection = True
+            return None
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return None
+    
+    def handle_warmup(self):
+        # 客戶端在自動換頁前告知下一頁，伺服器先取得畫面
+        body = self.read_json_body(WARMUP_MAX_BODY)
+        try:
+            index = int(body['page'])
+        except (TypeError, KeyError, ValueError):
+            self.send_error(400, "Bad Request", "需要 JSON 格式的 {\"page\": 頁碼}")
+            return
+        counts = warmup.page_warmer.warm(index)
+        if counts is None:
+            self.send_error(404, "Not Found", "找不到頁面")
+            return
+        self.send_json(dict(counts, page=index), status=202)
+    
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_cached_json(self, result):
+        # 支援 If-None-Match，內容未變時只回 304
+        if result is None:
+            self.send_error(404, "Not Found", "找不到頁面")
+            return
+        etag, body = result
+        if self.send_not_modified(etag):
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_not_modified(self, etag):
+        # 客戶端的 If-None-Match 符合時回 304 並回傳 True
+        if_none_match = self.headers.get('If-None-Match', '')
+        if etag not in [tag.strip() for tag in if_none_match.split(',')] and if_none_match.strip() != '*':
+            return False
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        return True
+    
+    def send_metrics(self):
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_frames(self):
+        # 回傳各攝影機目前的畫面世代，並讓排程持續更新這些攝影機
+        query = parse_qs(urlsplit(self.path).query)
+        cam_ids = [cam_id for cam_id in ','.join(query.get('ids', [])).split(',') if cam_id][:MAX_FRAME_IDS]
+        for cam_id in cam_ids:
+            url = proxy.link_index.lookup(cam_id)
+            if url is not None:
+                proxy.frame_scheduler.watch(cam_id, url)
+        self.send_json({"frames": proxy.frame_scheduler.generations(cam_ids)})
+    
+    def send_snapshot(self, cam_id):
+        try:
+            frame = get_snapshot(cam_id)
+        except Exception as e:
+            self.send_error(502, "Bad Gateway", f"無法取得畫面: {e}")
+            return
+        if frame is None:
+            self.send_error(404, "Camera Not Found", "找不到攝影機")
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', frame.content_type)
+        self.send_header('Content-Length', str(len(frame.data)))
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('X-Frame-Generation', str(frame.generation))
+        self.end_headers()
+        self.wfile.write(frame.data)
+    
+    def send_mosaic(self, page):
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            index = int(page)
+            width = int(query.get('w', [MOSAIC_TILE_WIDTH])[0])
+        except ValueError:
+            self.send_error(400, "Bad Request", "頁碼或寬度格式錯誤")
+            return
+        width = min(max(width // MOSAIC_WIDTH_STEP * MOSAIC_WIDTH_STEP, MOSAIC_MIN_WIDTH), MOSAIC_MAX_WIDTH)
+        try:
+            result = mosaic.mosaic_builder.get(index, width)
+        except ImportError:
+            self.send_error(501, "Not Implemented", "合成圖需要安裝 Pillow（pip install Pillow）")
+            return
+        if result is None:
+            self.send_error(404, "Not Found", "找不到頁面")
+            return
+        etag, data = result
+        if self.send_not_modified(etag):
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def query_time(self, name, default):
+        # 時間參數：epoch 秒數；0 或負數表示相對於現在的秒數（例如 -60 為一分鐘前）
+        values = parse_qs(urlsplit(self.path).query).get(name)
+        if not values:
+            return default
+        value = float(values[0])
+        return time.time() + value if value <= 0 else value
+    
+    def send_replay(self, cam_id):
+        try:
+            timestamp = self.query_time('t', time.time())
+        except ValueError:
+            self.send_error(400, "Bad Request", "時間格式錯誤")
+            return
+        result = recorder.frame_recorder.frame_at(cam_id, timestamp)
+        if result is None:
+            self.send_error(404, "Not Found", "沒有這台攝影機的錄影畫面")
+            return
+        frame_time, data = result
+        self.send_response(200)
+        self.send_header('Content-Type', image_content_type(data))
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('X-Frame-Time', f'{frame_time:.3f}')
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def send_recording_index(self, cam_id):
+        times = [round(timestamp, 3) for timestamp, _ in recorder.frame_recorder.frames(cam_id)]
+        self.send_json({
+            "id": cam_id,
+            "frames": len(times),
+            "start": times[0] if times else None,
+            "end": times[-1] if times else None,
+            "times": times,
+        })
+    
+    def send_timelapse(self, cam_id):
+        # 以 MJPEG 串流依序播放錄影畫面，播完即結束連線
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            start = self.query_time('from', None)
+            end = self.query_time('to', None)
+            fps = min(max(float(query.get('fps', [TIMELAPSE_FPS])[0]), 0.1), TIMELAPSE_MAX_FPS)
+        except ValueError:
+            self.send_error(400, "Bad Request", "參數格式錯誤")
+            return
+        frames = recorder.frame_recorder.frames(cam_id, start, end)
+        if not frames:
+            self.send_error(404, "Not Found", "沒有這段時間的錄影畫面")
+            return
+        
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + MJPEG_BOUNDARY.decode())
+            self.send_header('Cache-Control', 'no-store')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            self.connection.settimeout(MJPEG_CLIENT_TIMEOUT)
+            for _, seq in frames:
+                if self.server.closed:
+                    break
+                result = recorder.frame_recorder.read(cam_id, seq)
+                if result is None:
+                    continue  # 播放期間已被新畫面覆蓋
+                frame_time, data = result
+                self.wfile.write(b'--%s\r\nContent-Type: %s\r\nContent-Length: %d\r\nX-Frame-Time: %.3f\r\n\r\n'
+                                 % (MJPEG_BOUNDARY, image_content_type(data).encode(), len(data), frame_time))
+                self.wfile.write(data)
+                self.wfile.write(b'\r\n')
+                time.sleep(1 / fps)
+        except (ConnectionError, socket.timeout):
+            pass
+    
+    def send_events(self):
+        # 長時間連線的推播通道，在專用執行緒中執行直到客戶端離開
+        subscriber = events.event_bus.subscribe()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+            self.send_header('Cache-Control', 'no-store')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            self.connection.settimeout(MJPEG_CLIENT_TIMEOUT)
+            self.wfile.write(f'retry: {EVENT_RETRY_MS}\n\n'.encode() + format_event('hello', events.change_notifier.state()))
+            last_write = time.monotonic()
+            while not self.server.closed:
+                try:
+                    payload = subscriber.get(timeout=1)
+                except queue.Empty:
+                    if self.client_gone():
+                        break
+                    if time.monotonic() - last_write < EVENT_KEEPALIVE:
+                        continue
+                    payload = b': keepalive\n\n'
+                self.wfile.write(payload)
+                last_write = time.monotonic()
+        except (ConnectionError, socket.timeout):
+            pass
+        finally:
+            events.event_bus.unsubscribe(subscriber)
+    
+    def send_stream(self, cam_id):
+        relay = get_relay(cam_id)
+        if relay is None:
+            self.send_error(404, "Camera Not Found", "找不到攝影機")
+            return
+        
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + MJPEG_BOUNDARY.decode())
+            self.send_header('Cache-Control', 'no-store')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            
+            # 寫入逾時即視為慢速或已斷線的客戶端
+            self.connection.settimeout(MJPEG_CLIENT_TIMEOUT)
+            generation = 0
+            while (relay.alive or relay.generation > generation) and not self.server.closed:
+                result = relay.wait_frame(generation, MJPEG_CLIENT_TIMEOUT)
+                if result is None:
+                    if self.client_gone():
+                        break
+                    continue
+                generation, data = result
+                self.wfile.write(b'--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+                                 % (MJPEG_BOUNDARY, len(data)))
+                self.wfile.write(data)
+                self.wfile.write(b'\r\n')
+        except (ConnectionError, socket.timeout):
+            pass
+        finally:
+            relay.detach()
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """以固定大小的執行緒池處理連線，慢速請求不會阻塞其他請求
+    
+    新連線與閒置的 keep-alive 連線由 selector 等待，有請求到達時才交給執行緒池，
+    因此大量輪詢的客戶端不會佔滿工作執行緒。串流與推播等長時間連線解析請求後改由專用執行緒處理，
+    數量另有上限（max_streams），不會讓其他請求等不到執行緒。
+    """
+    request_queue_size = 128  # 大量客戶端同時連線時的等待佇列
+    
+    def __init__(self, server_address, handler_class, max_workers=SERVER_WORKERS,
+                 idle_timeout=KEEPALIVE_TIMEOUT, max_streams=STREAM_MAX_CONNECTIONS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='http')
+        self.stream_slots = threading.BoundedSemaphore(max_streams)
+        self.lock = threading.Lock()
+        self.streams = 0  # 專用執行緒處理中的長時間連線數
+        self.idle_timeout = idle_timeout
+        self.selector = selectors.DefaultSelector()
+        self.pending = deque()  # 等待加入 selector 的連線
+        self.waker, self.waker_sender = socket.socketpair()
+        self.waker.setblocking(False)
+        self.selector.register(self.waker, selectors.EVENT_READ)
+        self.closed = False
+        self.idle_thread = None  # 綁定失敗時 server_close 會在建立執行緒之前被呼叫
+        super().__init__(server_address, handler_class)
+        self.idle_thread = threading.Thread(target=self._watch_idle, daemon=True)
+        self.idle_thread.start()
+    
+    def process_request(self, request, client_address):
+        self.park(request, client_address)
+    
+    def park(self, request, client_address):
+        """交由 selector 等待連線的下一個請求"""
+        self.pending.append((request, client_address))
+        try:
+            self.waker_sender.send(b'\0')
+        except OSError:
+            pass
+    
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+    
+    def _process_request(self, request, client_address):
+        try:
+            handler = self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        if getattr(handler, 'detached', None) is not None:
+            threading.Thread(target=self._run_detached, args=(handler, request, client_address),
+                             daemon=True, name='http-stream').start()
+        elif getattr(handler, 'keep_alive', False) and not self.closed:
+            self.park(request, client_address)
+        else:
+            self.shutdown_request(request)
+    
+    def _run_detached(self, handler, request, client_address):
+        with self.lock:
+            self.streams += 1
+        try:
+            handler.run_detached()
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.lock:
+                self.streams -= 1
+            self.stream_slots.release()
+            self.shutdown_request(request)
+    
+    def _watch_idle(self):
+        # selector 只在這個執行緒中操作
+        while not self.closed:
+            for key, _ in self.selector.select(timeout=1):
+                if key.fileobj is self.waker:
+                    try:
+                        while self.waker.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                self.selector.unregister(key.fileobj)
+                try:
+                    self.executor.submit(self._process_request, key.fileobj, key.data[0])
+                except RuntimeError:
+                    # 執行緒池已關閉（伺服器或直譯器正在結束）
+                    self.shutdown_request(key.fileobj)
+                    return
+            
+            deadline = time.monotonic() + self.idle_timeout
+            while self.pending:
+                request, client_address = self.pending.popleft()
+                try:
+                    self.selector.register(request, selectors.EVENT_READ, (client_address, deadline))
+                except (ValueError, OSError):
+                    self.shutdown_request(request)
+            
+            # 關閉閒置過久的連線
+            now = time.monotonic()
+            for key in list(self.selector.get_map().values()):
+                if key.fileobj is not self.waker and key.data[1] < now:
+                    self.selector.unregister(key.fileobj)
+                    self.shutdown_request(key.fileobj)
+    
+    def server_close(self):
+        super().server_close()
+        self.closed = True
+        try:
+            self.waker_sender.send(b'\0')  # 喚醒 selector 執行緒
+        except OSError:
+            pass
+        if self.idle_thread is not None:
+            self.idle_thread.join(timeout=2)
+        for key in list(self.selector.get_map().values()):
+            if key.fileobj is not self.waker:
+                self.shutdown_request(key.fileobj)
+        self.selector.close()
+        self.waker.close()
+        self.waker_sender.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class ServerManager:
+    """管理整個程式共用的本地伺服器
+    
+    start() 在回傳前就已綁定埠號，之後在背景執行緒處理請求；
+    需要等待伺服器可用時呼叫 wait_ready()，不必輪詢。
+    """
+    def __init__(self, ports=SERVER_PORTS, max_workers=SERVER_WORKERS):
+        self.ports = ports
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.httpd = None
+        self.thread = None
+        self.port = None
+    
+    def start(self):
+        """啟動伺服器（已啟動時直接回傳），回傳綁定的埠號；所有埠號都無法使用時拋出 OSError"""
+        global PORT
+        with self.lock:
+            if self.httpd is not None:
+                return self.port
+            last_error = None
+            for port in self.ports:
+                try:
+                    httpd = PooledHTTPServer(("", port), CustomHandler, self.max_workers)
+                    break
+                except OSError as e:
+                    print(f"端口 {port} 錯誤: {e}")
+                    last_error = e
+            else:
+                raise OSError(f"無法綁定任何埠號: {last_error}")
+            self.httpd = httpd
+            self.port = PORT = httpd.server_address[1]
+            self.thread = threading.Thread(target=self._serve, args=(httpd,), daemon=True)
+            self.thread.start()
+            proxy.health_prober.start()
+            recorder.frame_recorder.start()
+            events.change_notifier.start()
+            print(f"伺服器執行於 {self.url()}（最多 {self.max_workers} 個連線同時處理）")
+            print(f"根目錄: {get_app_dir()}")
+            return self.port
+    
+    def _serve(self, httpd):
+        # 埠號已在監聽，此時開始的連線都會被處理
+        self.ready.set()
+        httpd.serve_forever()
+    
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+    
+    def url(self, path=''):
+        return f'http://localhost:{self.port}/{path}'
+    
+    def stop(self):
+        """停止伺服器並關閉所有連線"""
+        with self.lock:
+            httpd, thread = self.httpd, self.thread
+            self.httpd = self.thread = self.port = None
+            self.ready.clear()
+        if httpd is None:
+            return
+        proxy.health_prober.stop()
+        recorder.frame_recorder.stop()
+        events.change_notifier.stop()
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join(timeout=5)
+
+server_manager = ServerManager()
+metrics.gauge('cctv_http_streams', '專用執行緒處理中的長時間連線數',
+              lambda: server_manager.httpd.streams if server_manager.httpd is not None else 0)
+
+def start_server(max_workers=SERVER_WORKERS):
+    """啟動共用的 HTTP 伺服器，回傳埠號"""
+    server_manager.max_workers = max_workers
+    return server_manager.start()
@@ -0,0 +1,286 @@
+"""
+連結資料庫（SQLite）、cctv_links.json 匯出與 JSON 編輯器的資料模型
+"""
+
+from contextlib import contextmanager
+import json
+from datetime import datetime
+import os
+import threading
+import sqlite3
+from cctv.core import atomic_write, get_app_dir, metrics
+
+metrics.describe('cctv_store_write_seconds', 'histogram', '寫入連結資料庫並匯出 JSON 的時間')
+metrics.describe('cctv_store_links_added_total', 'counter', '新增到連結資料庫的連結數')
+
+# 連結儲存設定
+LINKS_FILE = 'cctv_links.json'  # 連結檔名（供 index.html 讀取）
+LINKS_DB = 'cctv_links.db'  # 連結資料庫
+PAGE_SIZE = 9  # 每頁連結數
+
+def links_path():
+    """cctv_links.json 的完整路徑"""
+    return os.path.join(get_app_dir(), LINKS_FILE)
+
+class LinkStore:
+    """以 SQLite 儲存連結：網址唯一索引去重、新連結接續最後一頁，並以原子方式匯出 cctv_links.json
+    
+    若 cctv_links.json 在外部被修改（與上次匯出的修改時間不同），會先重新匯入再寫入。
+    """
+    def __init__(self, path=None, export_path=None):
+        self.path = path or os.path.join(get_app_dir(), LINKS_DB)
+        self.export_path = export_path or links_path()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS links ('
+                'url TEXT PRIMARY KEY, page INTEGER NOT NULL, slot INTEGER NOT NULL)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS links_position ON links (page, slot)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+        with self.lock:
+            self._sync_from_json()
+    
+    def _meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else row[0]
+    
+    def _set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+    
+    def _bump_version(self):
+        self._set_meta('version', self._meta('version', 0) + 1)
+    
+    @contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE 先取得寫入鎖：其他行程（例如排程的 extract --save）同時寫入時會等待，
+        # 不會兩邊讀到同一個最後一頁而各自填超過 PAGE_SIZE
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            yield
+    
+    def _export_mtime(self):
+        try:
+            return os.stat(self.export_path).st_mtime_ns
+        except OSError:
+            return None
+    
+    def _sync_from_json(self):
+        # JSON 檔在外部被修改時以檔案內容為準
+        mtime = self._export_mtime()
+        if mtime is None or mtime == self._meta('export_mtime'):
+            return
+        with self._write():
+            self._import_json()
+    
+    def _import_json(self):
+        # 在寫入交易中呼叫：其他行程只在持有寫入鎖時匯出，此時檔案與紀錄一定一致，
+        # 只有真正在外部修改過的檔案才會被匯入，不會把等待期間讀到的舊檔案蓋回資料庫
+        mtime = self._export_mtime()
+        if mtime is None or mtime == self._meta('export_mtime'):
+            return
+        try:
+            with open(self.export_path, 'r', encoding='utf-8') as f:
+                pages = json.load(f).get("pages", [])
+        except (OSError, json.JSONDecodeError):
+            return
+        self._replace(pages)
+        self._set_meta('export_mtime', mtime)
+    
+    def _replace(self, pages):
+        self.conn.execute('DELETE FROM links')
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO links (url, page, slot) VALUES (?, ?, ?)',
+            ((link, page_index, slot)
+             for page_index, page in enumerate(pages)
+             for slot, link in enumerate(page) if link)
+        )
+        self._bump_version()
+    
+    def add_links(self, links):
+        """加入新連結（已存在的略過），回傳實際新增的數量"""
+        with metrics.timer('cctv_store_write_seconds', op='add'), self.lock:
+            with self._write():
+                self._import_json()
+                page, slot, count = self.conn.execute(
+                    'SELECT MAX(page), MAX(slot), COUNT(*) FROM links '
+                    'WHERE page = (SELECT MAX(page) FROM links)'
+                ).fetchone()
+                if page is None:
+                    page, slot = 0, -1
+                added = 0
+                for link in links:
+                    # 最後一頁已滿時換到新頁面
+                    if count >= PAGE_SIZE:
+                        page, slot, count = page + 1, -1, 0
+                    cursor = self.conn.execute(
+                        'INSERT OR IGNORE INTO links (url, page, slot) VALUES (?, ?, ?)',
+                        (link, page, slot + 1)
+                    )
+                    if cursor.rowcount:
+                        slot += 1
+                        count += 1
+                        added += 1
+                if added:
+                    self._bump_version()
+                    self._export()
+            metrics.inc('cctv_store_links_added_total', added)
+            return added
+    
+    def replace_pages(self, pages):
+        """以新的分頁內容取代全部連結（編輯器儲存時使用）"""
+        with metrics.timer('cctv_store_write_seconds', op='replace'), self.lock:
+            with self._write():
+                self._replace(pages)
+                self._export()
+    
+    def update_pages(self, changes):
+        """只改寫指定的頁面 {頁碼: 連結列表}（其他頁面不動），回傳因重複而略過的連結數"""
+        with metrics.timer('cctv_store_write_seconds', op='update'), self.lock:
+            with self._write():
+                self._import_json()
+                self.conn.executemany('DELETE FROM links WHERE page = ?', ((page,) for page in changes))
+                skipped = 0
+                for page, links in changes.items():
+                    slot = 0
+                    for link in links:
+                        if not link:
+                            continue
+                        cursor = self.conn.execute(
+                            'INSERT OR IGNORE INTO links (url, page, slot) VALUES (?, ?, ?)',
+                            (link, page, slot)
+                        )
+                        if cursor.rowcount:
+                            slot += 1
+                        else:
+                            skipped += 1
+                self._bump_version()
+                self._export()
+            return skipped
+    
+    def page_numbers(self):
+        """回傳有連結的頁碼（由小到大）"""
+        with self.lock:
+            self._sync_from_json()
+            return [row[0] for row in self.conn.execute('SELECT DISTINCT page FROM links ORDER BY page')]
+    
+    def page_links(self, page):
+        """回傳單一頁面的連結"""
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT url FROM links WHERE page = ? ORDER BY slot', (page,))]
+    
+    def find_pages(self, text):
+        """回傳連結包含 text（不分大小寫）的頁碼"""
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT DISTINCT page FROM links WHERE instr(lower(url), lower(?)) > 0 ORDER BY page', (text,))]
+    
+    def pages(self):
+        """回傳所有非空頁面的連結列表"""
+        with self.lock:
+            self._sync_from_json()
+            return self._pages()
+    
+    def version(self):
+        with self.lock:
+            return self._meta('version', 0)
+    
+    def stats(self):
+        """回傳 (連結數, 頁數)"""
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*), COUNT(DISTINCT page) FROM links').fetchone()
+    
+    def _pages(self):
+        pages = []
+        last_page = None
+        for url, page in self.conn.execute('SELECT url, page FROM links ORDER BY page, slot'):
+            if page != last_page:
+                pages.append([])
+                last_page = page
+            pages[-1].append(url)
+        return pages
+    
+    def _export(self):
+        # 在寫入交易中呼叫：匯出的順序與資料庫的寫入順序相同，較舊的內容不會蓋掉較新的檔案
+        data = {
+            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+            "pages": self._pages()
+        }
+        with atomic_write(self.export_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        self._set_meta('export_mtime', self._export_mtime())
+
+link_store = None  # 共用的連結資料庫
+
+def get_link_store():
+    """取得共用的連結資料庫"""
+    global link_store
+    if link_store is None:
+        link_store = LinkStore()
+    return link_store
+
+class LinkEditorModel:
+    """連結編輯器的資料模型
+    
+    頁面內容在顯示時才從資料庫載入，並記錄修改過的頁面，儲存時只寫回這些頁面。
+    """
+    def __init__(self, store):
+        self.store = store
+        self.page_keys = store.page_numbers() or [0]  # 顯示順序 -> 資料庫頁碼
+        self.loaded = {}  # 顯示順序 -> 連結列表（固定 PAGE_SIZE 格）
+        self.dirty = set()
+    
+    def __len__(self):
+        return len(self.page_keys)
+    
+    def get(self, index):
+        if index not in self.loaded:
+            links = self.store.page_links(self.page_keys[index])
+            self.loaded[index] = (links + [''] * PAGE_SIZE)[:PAGE_SIZE]
+        return list(self.loaded[index])
+    
+    def set(self, index, links):
+        links = [link.strip() for link in links]
+        if links != self.get(index):
+            self.loaded[index] = links
+            self.dirty.add(index)
+    
+    def add_page(self):
+        """在最後新增空白頁面，回傳其顯示順序"""
+        self.page_keys.append(max(self.page_keys) + 1)
+        index = len(self.page_keys) - 1
+        self.loaded[index] = [''] * PAGE_SIZE
+        return index
+    
+    def search(self, text, start=0):
+        """從 start 之後找下一個包含 text 的頁面（循環），找不到回傳 None"""
+        text = text.strip().lower()
+        if not text:
+            return None
+        key_to_index = {key: index for index, key in enumerate(self.page_keys)}
+        # 未修改的頁面直接查資料庫，修改過的頁面查記憶體中的內容
+        matches = {key_to_index[key] for key in self.store.find_pages(text)
+                   if key in key_to_index and key_to_index[key] not in self.dirty}
+        matches.update(index for index in self.dirty
+                       if any(text in link.lower() for link in self.loaded[index]))
+        for offset in range(1, len(self.page_keys) + 1):
+            index = (start + offset) % len(self.page_keys)
+            if index in matches:
+                return index
+        return None
+    
+    def save(self):
+        """寫回修改過的頁面，回傳 (寫回頁數, 因重複而略過的連結數)"""
+        changes = {self.page_keys[index]: [link for link in self.loaded[index] if link]
+                   for index in self.dirty}
+        if not changes:
+            return 0, 0
+        skipped = self.store.update_pages(changes)
+        for index in self.dirty:
+            # 重複的連結已被略過，下次顯示時重新載入
+            del self.loaded[index]
+        self.dirty.clear()
+        return len(changes), skipped
@@ -0,0 +1,74 @@
+"""
+在自動換頁前預先取得下一頁的畫面
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from cctv.core import metrics
+from cctv.store import PAGE_SIZE
+from cctv.frames import camera_id, is_mjpeg_url
+from cctv.proxy import get_relay, load_frame
+from cctv import proxy
+
+# 換頁預熱設定
+WARMUP_WORKERS = 3  # 同時預熱取圖的數量上限，避免與目前頁面搶用上游連線
+WARMUP_MAX_PENDING = 2 * PAGE_SIZE  # 排隊中的預熱攝影機數上限，超過的請求直接略過
+WARMUP_MAX_BODY = 4096  # /api/warmup 請求內容的大小上限
+
+metrics.describe('cctv_warmup_total', 'counter', '換頁預熱的攝影機數（依處理方式）')
+
+class PageWarmer:
+    """在自動換頁前預先取得下一頁的快照並開啟 MJPEG 轉送
+    
+    快照以固定數量的執行緒取得，不佔用排程的連線，並以背景請求送出，上游權杖優先留給觀看中的請求；
+    已有新畫面或正在排隊的攝影機直接略過。
+    串流只啟動轉送而不計為觀看者，客戶端在閒置逾時前連上即可立即收到畫面。
+    """
+    def __init__(self, workers=WARMUP_WORKERS, max_pending=WARMUP_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = set()  # 排隊或取圖中的攝影機
+        self.executor = None
+    
+    def warm(self, index):
+        """預熱指定頁面，回傳 {處理方式: 攝影機數}；頁碼超出範圍時回傳 None"""
+        page = proxy.link_index.page_links(index)
+        if page is None:
+            return None
+        counts = {'snapshot': 0, 'stream': 0, 'skipped': 0}
+        for link in page[1]:
+            cam_id = camera_id(link)
+            alive = proxy.health_prober.is_alive(cam_id)
+            kind = 'skipped'
+            if alive and is_mjpeg_url(link):
+                relay = get_relay(cam_id)
+                if relay is not None:
+                    relay.detach()
+                    kind = 'stream'
+            elif alive and proxy.frame_cache.get(cam_id) is None and self._submit(cam_id, link):
+                kind = 'snapshot'
+            counts[kind] += 1
+            metrics.inc('cctv_warmup_total', kind=kind)
+        return counts
+    
+    def _submit(self, cam_id, url):
+        with self.lock:
+            if cam_id in self.pending or len(self.pending) >= self.max_pending:
+                return False
+            self.pending.add(cam_id)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='warmup')
+        self.executor.submit(self._load, cam_id, url)
+        return True
+    
+    def _load(self, cam_id, url):
+        try:
+            load_frame(cam_id, url, background=True)
+        except Exception:
+            pass
+        finally:
+            with self.lock:
+                self.pending.discard(cam_id)
+
+page_warmer = PageWarmer()